@@ -14,17 +14,76 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
 
 
-# noinspection PyUnresolvedReferences
-from .uv_semi_mirror import mirror_uv
-# noinspection PyUnresolvedReferences
-from .utils import Axis, UVRegion
-# noinspection PyUnresolvedReferences
-from .export import copy_join, export_for_unity, freeze_modifiers, merge_by_distance, symmetrize_armature
-# noinspection PyUnresolvedReferences
-from .materials import merge_materials, remove_material, remove_face_of_materials, simple_merge_materials
-# noinspection PyUnresolvedReferences
-from .faces import remove_face_of_group
-from .output_file_chooser import ask_export
+import importlib
+import sys
+import types
+from typing import Any, Dict, List, Optional, Tuple
+
+# public names and the module they're defined in.
+# modules are imported on first access so loading this library is cheap.
+# None as name means the module itself.
+_PUBLIC_NAMES: Dict[str, Tuple[str, Optional[str]]] = {
+    "mirror_uv": (".uv_semi_mirror", "mirror_uv"),
+    "Axis": (".utils", "Axis"),
+    "UVRegion": (".utils", "UVRegion"),
+    "copy_join": (".mesh_join", "copy_join"),
+    "export_for_unity": (".export", "export_for_unity"),
+    "freeze_modifiers": (".freeze_modifiers", "freeze_modifiers"),
+    "merge_by_distance": (".export", "merge_by_distance"),
+    "symmetrize_armature": (".export", "symmetrize_armature"),
+    "apply_transforms": (".export", "apply_transforms"),
+    "merge_materials": (".materials", "merge_materials"),
+    "remove_material": (".materials", "remove_material"),
+    "remove_face_of_materials": (".materials", "remove_face_of_materials"),
+    "simple_merge_materials": (".materials", "simple_merge_materials"),
+    "remap_materials": (".materials", "remap_materials"),
+    "merge_materials_with_atlas": (".atlas", "merge_materials_with_atlas"),
+    "pack_atlas": (".atlas", "pack_atlas"),
+    "remove_face_of_group": (".faces", "remove_face_of_group"),
+    "select_mirroring": (".select_mirroring", "select_mirroring"),
+    "OperatorContext": (".operator_context", "OperatorContext"),
+    "MeshArrays": (".mesh_arrays", "MeshArrays"),
+    "ask_export": (".output_file_chooser", "ask_export"),
+    "BuildJob": (".build_farm", "BuildJob"),
+    "BuildResult": (".build_farm", "BuildResult"),
+    "run_builds": (".build_farm", "run_builds"),
+    "run_recipe": (".recipe", "run_recipe"),
+    "load_recipe": (".recipe", "load_recipe"),
+    "profiling": (".profiling", None),
+}
+
+
+def __getattr__(name: str) -> Any:
+    found = _PUBLIC_NAMES.get(name)
+    if found is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    importlib.import_module(found[0], __name__)
+    _bind_loaded_names()
+    return globals()[name]
+
+
+def _bind_loaded_names():
+    """
+        bind public names of loaded modules so __getattr__ is not called again.
+        importing a submodule binds it to the package, which shadows the function of the same name
+        like freeze_modifiers, so such names are bound again.
+        names replaced with functions, like wrappers of profiling, are kept.
+    """
+    for name, (module_name, attr) in _PUBLIC_NAMES.items():
+        module = sys.modules.get(__name__ + module_name)
+        if module is None:
+            continue
+        current = globals().get(name)
+        if current is None or attr is not None and isinstance(current, types.ModuleType):
+            # None if the module is still being imported
+            value = module if attr is None else getattr(module, attr, None)
+            if value is not None:
+                globals()[name] = value
+
+
+def __dir__() -> List[str]:
+    return sorted({*globals(), *_PUBLIC_NAMES})
+
 
 bl_info = {
     "name": "anatawa12's library",
@@ -38,7 +97,7 @@ bl_info = {
     "wiki_url": "",
     "tracker_url": "",
     "category": "Object",
-    "anatawa12_library_selector": 7,
+    "anatawa12_library_selector": 21,
 }
 
 
@@ -0,0 +1,162 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# texture atlas of materials.
+# base color images of materials are packed into one image and UVs are remapped with merge_materials.
+# UVs outside of 0..1 (repeating textures) can't be represented in the atlas.
+
+from typing import Dict, Iterable, List, Optional, Tuple, cast
+
+import bpy
+import numpy as np
+from bpy.types import BlendDataImages, BlendDataMaterials, Image, Material, Mesh, Node, Object, ShaderNodeTexImage
+
+from .materials import merge_materials
+from .utils import UVLayers, UVRegion
+
+
+def merge_materials_with_atlas(
+        obj: Object,
+        final_material: str,
+        materials: Optional[Iterable[str]] = None,
+        image_name: Optional[str] = None,
+        max_size: int = 4096,
+        padding: int = 4,
+        uv_layers: UVLayers = None,
+) -> Dict[str, UVRegion]:
+    """
+        pack base color images of materials into an atlas image and merge the materials into final_material.
+        materials defaults to all materials of obj. final_material is created with the atlas if not exists.
+        returns the region of each material in the atlas.
+    """
+    mesh = obj.data
+    if not isinstance(mesh, Mesh):
+        raise Exception("object is not mesh")
+    if materials is None:
+        names = [m.name for m in cast(List[Material], mesh.materials) if m is not None and m.name != final_material]
+    else:
+        names = [*materials]
+    image, regions = pack_atlas(names, image_name if image_name is not None else final_material, max_size, padding)
+
+    if cast(Dict[str, Material], bpy.data.materials).get(final_material) is None:
+        _new_atlas_material(final_material, image)
+    merge_materials(obj, regions, final_material, uv_layers)
+    return regions
+
+
+def pack_atlas(
+        materials: List[str],
+        image_name: str,
+        max_size: int = 4096,
+        padding: int = 4,
+) -> Tuple[Image, Dict[str, UVRegion]]:
+    """
+        create an atlas image of base color images of materials.
+        edge pixels of each image are extended into padding to avoid bleeding on mipmaps.
+        returns the image and the region of each material in the atlas.
+    """
+    images = {name: _find_base_color_image(name) for name in materials}
+    sizes: List[Tuple[int, int]] = []
+    for name, image in images.items():
+        width, height = image.size
+        if width == 0 or height == 0:
+            raise Exception(f"image {image.name} of material {name} has no pixels")
+        sizes.append((width + padding * 2, height + padding * 2))
+
+    atlas_width, atlas_height, positions = _choose_layout(sizes, max_size)
+
+    pixels = np.zeros((atlas_height, atlas_width, 4), dtype=np.float32)
+    regions: Dict[str, UVRegion] = {}
+    for (name, image), (x, y) in zip(images.items(), positions):
+        width, height = image.size
+        image_pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(image_pixels)
+        padded = np.pad(image_pixels.reshape(height, width, 4), ((padding, padding), (padding, padding), (0, 0)),
+                        mode='edge')
+        pixels[y:y + padded.shape[0], x:x + padded.shape[1]] = padded
+        # rows of Image.pixels are bottom to top like v of uv
+        regions[name] = UVRegion((x + padding) / atlas_width, (y + padding) / atlas_height,
+                                 width / atlas_width, height / atlas_height)
+
+    atlas = cast(BlendDataImages, bpy.data.images).new(image_name, atlas_width, atlas_height, alpha=True)
+    atlas.pixels.foreach_set(pixels.ravel())
+    atlas.pack()
+    return atlas, regions
+
+
+def _find_base_color_image(material_name: str) -> Image:
+    """image connected to base color of principled bsdf, or the first image texture of the material"""
+    material = cast(Dict[str, Material], bpy.data.materials).get(material_name)
+    if material is None:
+        raise Exception(f"material named {material_name} not found")
+    if material.node_tree is None:
+        raise Exception(f"material {material_name} has no image texture")
+    for node in cast(Iterable[Node], material.node_tree.nodes):
+        if node.type == 'BSDF_PRINCIPLED':
+            for link in node.inputs['Base Color'].links:
+                if link.from_node.type == 'TEX_IMAGE' and link.from_node.image is not None:
+                    return link.from_node.image
+    for node in cast(Iterable[Node], material.node_tree.nodes):
+        if node.type == 'TEX_IMAGE' and cast(ShaderNodeTexImage, node).image is not None:
+            return cast(ShaderNodeTexImage, node).image
+    raise Exception(f"material {material_name} has no image texture")
+
+
+def _choose_layout(sizes: List[Tuple[int, int]], max_size: int) -> Tuple[int, int, List[Tuple[int, int]]]:
+    """power of two atlas size with smallest area and positions in it"""
+    best: Optional[Tuple[int, int, List[Tuple[int, int]]]] = None
+    width = _ceil_power_of_two(max((w for w, _ in sizes), default=1))
+    while width <= max_size:
+        positions, used_height = _shelf_pack(sizes, width)
+        height = _ceil_power_of_two(used_height)
+        if height <= max_size and (best is None or (width * height, max(width, height)) <
+                                   (best[0] * best[1], max(best[0], best[1]))):
+            best = (width, height, positions)
+        width *= 2
+    if best is None:
+        raise Exception(f"images can't be packed into {max_size}x{max_size} atlas")
+    return best
+
+
+def _shelf_pack(sizes: List[Tuple[int, int]], width: int) -> Tuple[List[Tuple[int, int]], int]:
+    """place rectangles on shelves from tallest one. returns positions and used height"""
+    positions: List[Tuple[int, int]] = [(0, 0)] * len(sizes)
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        w, h = sizes[i]
+        if x + w > width:
+            y += shelf_height
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return positions, y + shelf_height
+
+
+def _ceil_power_of_two(value: int) -> int:
+    return 1 << max(value - 1, 0).bit_length()
+
+
+def _new_atlas_material(name: str, image: Image) -> Material:
+    material = cast(BlendDataMaterials, bpy.data.materials).new(name)
+    material.use_nodes = True
+    nodes = material.node_tree.nodes
+    bsdf = next(node for node in nodes if node.type == 'BSDF_PRINCIPLED')
+    texture = cast(ShaderNodeTexImage, nodes.new('ShaderNodeTexImage'))
+    texture.image = image
+    texture.location = (bsdf.location.x - 300, bsdf.location.y)
+    material.node_tree.links.new(texture.outputs['Color'], bsdf.inputs['Base Color'])
+    material.node_tree.links.new(texture.outputs['Alpha'], bsdf.inputs['Alpha'])
+    return material
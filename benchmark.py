@@ -0,0 +1,361 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# benchmark of hot operations on synthetic meshes. run with
+#   blender -b --factory-startup --python benchmark.py -- [--output result.json] [--baseline baseline.json]
+#       [--vertices 1000,10000] [--shape-keys 0,50] [--materials 1,10] [--operations mirror_uv,copy_join]
+#       [--repeats 5]
+# minimum wall time of repeated runs and peak memory of each operation are written to output
+# and compared with baseline.
+# operation "import" measures time to import the library and to load each public name.
+
+import importlib
+import itertools
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, cast
+
+import bpy
+import numpy as np
+from bpy.types import Object
+
+try:
+    import resource
+except ImportError:
+    # not available on windows. only peak of python memory is measured
+    resource = None
+
+DEFAULT_VERTICES = [1000, 10000, 100000, 500000]
+DEFAULT_SHAPE_KEYS = [0, 10, 50, 200]
+DEFAULT_MATERIALS = [1, 10, 50]
+# ratio of time to baseline regarded as regression
+DEFAULT_TOLERANCE = 1.2
+# timed runs of each case. minimum of them is compared
+DEFAULT_REPEATS = 5
+
+
+def _load_library():
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(package_dir))
+    return importlib.import_module(os.path.basename(package_dir))
+
+
+lib: Any = None
+
+
+# synthetic data
+
+def make_grid(name: str, vertices: int, materials: int = 1, shape_keys: int = 0, split: bool = False) -> Object:
+    """
+        square grid on XY plane symmetric on X axis with about vertices vertices.
+        polygons use materials in turn and the left half is in vertex group 'left'.
+        if split, each quad has its own four vertices slightly jittered, so vertices have near-duplicates.
+    """
+    side = max(int(math.sqrt(vertices)) | 1, 3)  # odd to have center column
+    xs, ys = np.meshgrid(np.linspace(-1, 1, side), np.linspace(-1, 1, side))
+    co = np.stack([xs.ravel(), ys.ravel(), np.zeros(side * side)], axis=1).astype(np.float32)
+
+    cell_x, cell_y = np.meshgrid(np.arange(side - 1), np.arange(side - 1))
+    first = (cell_y * side + cell_x).ravel()
+    quads = np.stack([first, first + 1, first + side + 1, first + side], axis=1).astype(np.int32)
+    if split:
+        jitter = np.random.default_rng(0).uniform(-1e-6, 1e-6, (quads.size, 3)).astype(np.float32)
+        co = co[quads.ravel()] + jitter
+        quads = np.arange(quads.size, dtype=np.int32).reshape(-1, 4)
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.loops.add(quads.size)
+    mesh.loops.foreach_set("vertex_index", quads.ravel())
+    mesh.polygons.add(len(quads))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, quads.size, 4, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_total", np.full(len(quads), 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+    uv_layer = mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", ((co[quads.ravel(), :2] + 1) / 2).ravel())
+
+    for i in range(materials):
+        material = bpy.data.materials.get(f"bench_mat{i}") or bpy.data.materials.new(f"bench_mat{i}")
+        mesh.materials.append(material)
+    mesh.polygons.foreach_set("material_index", (np.arange(len(quads)) % materials).astype(np.int32))
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+
+    left = obj.vertex_groups.new(name="left")
+    left.add(np.flatnonzero(co[:, 0] < 0).tolist(), 1.0, 'REPLACE')
+
+    if shape_keys != 0:
+        obj.shape_key_add(name="Basis", from_mix=False)
+        rng = np.random.default_rng(0)
+        for i in range(shape_keys):
+            key = obj.shape_key_add(name=f"key{i}", from_mix=False)
+            key.data.foreach_set("co", (co + rng.normal(0, 0.01, co.shape).astype(np.float32)).ravel())
+    return obj
+
+
+def clear_scene():
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+
+
+# operations: setup builds the scene and returns the function to measure
+
+Setup = Callable[[int, int, int], Callable[[], Any]]
+
+
+def _setup_mirror_uv(vertices: int, shape_keys: int, materials: int):
+    obj = make_grid("bench", vertices)
+    return lambda: lib.mirror_uv(obj, uv_mirror_axis=lib.Axis.X)
+
+
+def _setup_merge_materials(vertices: int, shape_keys: int, materials: int):
+    obj = make_grid("bench", vertices, materials=materials)
+    columns = math.ceil(math.sqrt(materials))
+    regions = {f"bench_mat{i}": lib.UVRegion((i % columns) / columns, (i // columns) / columns,
+                                            1 / columns, 1 / columns)
+               for i in range(materials)}
+    return lambda: lib.merge_materials(obj, regions, "bench_atlas")
+
+
+def _setup_remove_face_of_group(vertices: int, shape_keys: int, materials: int):
+    obj = make_grid("bench", vertices)
+    return lambda: lib.remove_face_of_group(obj, "left")
+
+
+def _setup_freeze_modifiers(vertices: int, shape_keys: int, materials: int):
+    obj = make_grid("bench", vertices, shape_keys=shape_keys)
+    obj.modifiers.new("displace", 'DISPLACE')
+    return lambda: lib.freeze_modifiers(obj, ["displace"])
+
+
+def _setup_copy_join(vertices: int, shape_keys: int, materials: int):
+    objs = [make_grid(f"bench{i}", vertices // 4, materials=materials, shape_keys=shape_keys) for i in range(4)]
+    for i, obj in enumerate(objs):
+        obj.location.x = i * 3
+    return lambda: lib.copy_join(objs, "bench_joined")
+
+
+def _setup_merge_by_distance(vertices: int, shape_keys: int, materials: int):
+    # about vertices vertices before the merge, and about a quarter of them after
+    obj = make_grid("bench", vertices // 4, shape_keys=shape_keys, split=True)
+    name = obj.name
+
+    def function():
+        if lib.merge_by_distance(obj, threshold=1e-4)[name] == 0:
+            raise Exception("no vertices are merged")
+    return function
+
+
+def _setup_export_for_unity(vertices: int, shape_keys: int, materials: int):
+    obj = make_grid("bench", vertices, materials=materials, shape_keys=shape_keys)
+    path = os.path.join(tempfile.mkdtemp(), "bench.fbx")
+    return lambda: lib.export_for_unity([obj], path)
+
+
+# operation name: setup, if shape keys are used, if materials are used
+OPERATIONS: Dict[str, Tuple[Setup, bool, bool]] = {
+    "mirror_uv": (_setup_mirror_uv, False, False),
+    "merge_materials": (_setup_merge_materials, False, True),
+    "remove_face_of_group": (_setup_remove_face_of_group, False, False),
+    "freeze_modifiers": (_setup_freeze_modifiers, True, False),
+    "copy_join": (_setup_copy_join, True, True),
+    "merge_by_distance": (_setup_merge_by_distance, True, False),
+    "export_for_unity": (_setup_export_for_unity, True, True),
+}
+
+
+# measurement
+
+def measure(make_case: Callable[[], Callable[[], Any]], repeats: int = DEFAULT_REPEATS) -> Dict[str, float]:
+    """
+        make_case sets up new data and returns the function to measure, since operations modify the data.
+        after a warmup run, time is measured in repeats runs and memory in another run
+        since tracemalloc slows down python code a lot.
+    """
+    make_case()()
+    times: List[float] = []
+    for _ in range(repeats):
+        function = make_case()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    function = make_case()
+    tracemalloc.start()
+    rss_before = _max_rss()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    rss_after = _max_rss()
+    result = {
+        "time": min(times),
+        "median_time": float(np.median(times)),
+        "peak_python_memory": peak,
+    }
+    if rss_before is not None and rss_after is not None:
+        # increase of peak of the process
+        result["peak_rss_increase"] = rss_after - rss_before
+    return result
+
+
+def _max_rss() -> Optional[int]:
+    """peak resident set size of the process in bytes, or None if not available"""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def run(
+        operations: Sequence[str],
+        vertices_list: Sequence[int],
+        shape_keys_list: Sequence[int],
+        materials_list: Sequence[int],
+        repeats: int = DEFAULT_REPEATS,
+) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for name in operations:
+        setup, use_shape_keys, use_materials = OPERATIONS[name]
+        for vertices, shape_keys, materials in itertools.product(
+                vertices_list,
+                shape_keys_list if use_shape_keys else [0],
+                materials_list if use_materials else [1]):
+            def make_case():
+                clear_scene()
+                return setup(vertices, shape_keys, materials)
+            result = dict(operation=name, vertices=vertices, shape_keys=shape_keys, materials=materials)
+            result.update(measure(make_case, repeats))
+            print(f"{name:<22} v={vertices:<7} sk={shape_keys:<4} mat={materials:<3} {result['time']:9.4f}s "
+                  f"(median {result['median_time']:.4f}s)")
+            results.append(result)
+    clear_scene()
+    return results
+
+
+def measure_import() -> List[Dict[str, Any]]:
+    """
+        time to import the library, and to resolve each public name for the first time.
+        modules of the library are unloaded before each measurement.
+    """
+    global lib
+    package_name = lib.__name__
+
+    def unload():
+        for name in [n for n in sys.modules if n == package_name or n.startswith(package_name + ".")]:
+            del sys.modules[name]
+
+    def record(operation: str, elapsed: float) -> Dict[str, Any]:
+        print(f"{operation:<40} {elapsed:9.4f}s")
+        return dict(operation=operation, vertices=0, shape_keys=0, materials=0, time=elapsed)
+
+    results: List[Dict[str, Any]] = []
+    unload()
+    start = time.perf_counter()
+    package = importlib.import_module(package_name)
+    results.append(record("import", time.perf_counter() - start))
+    for name in cast(Dict[str, Any], getattr(package, "_PUBLIC_NAMES", {})):
+        unload()
+        package = importlib.import_module(package_name)
+        start = time.perf_counter()
+        getattr(package, name)
+        results.append(record(f"import:{name}", time.perf_counter() - start))
+    unload()
+    lib = importlib.import_module(package_name)
+    return results
+
+
+def _case_key(result: Dict[str, Any]) -> Tuple[str, int, int, int]:
+    return result["operation"], result["vertices"], result["shape_keys"], result["materials"]
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """returns list of regressions"""
+    baseline_by_case = {_case_key(r): r for r in baseline}
+    regressions: List[str] = []
+    for result in results:
+        base = baseline_by_case.get(_case_key(result))
+        if base is None:
+            continue
+        ratio = result["time"] / max(base["time"], 1e-9)
+        line = f"{'/'.join(map(str, _case_key(result)))}: {base['time']:.4f}s -> {result['time']:.4f}s ({ratio:.2f}x)"
+        print(line)
+        if ratio > tolerance:
+            regressions.append(line)
+    return regressions
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv: Sequence[str]) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="benchmark of anatawa12's library")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    # "import" measures import time of the library
+    parser.add_argument("--operations", default=",".join(["import", *OPERATIONS.keys()]))
+    parser.add_argument("--vertices", type=_int_list, default=DEFAULT_VERTICES)
+    parser.add_argument("--shape-keys", type=_int_list, default=DEFAULT_SHAPE_KEYS)
+    parser.add_argument("--materials", type=_int_list, default=DEFAULT_MATERIALS)
+    args = parser.parse_args(argv)
+
+    global lib
+    lib = _load_library()
+
+    operations = args.operations.split(",")
+    results = measure_import() if "import" in operations else []
+    results += run([op for op in operations if op != "import"], args.vertices, args.shape_keys, args.materials,
+                   args.repeats)
+    document = {"blender": list(bpy.app.version), "library": lib.bl_info["anatawa12_library_selector"],
+                "results": results}
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = cast(List[Dict[str, Any]], json.load(f)["results"])
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions) != 0:
+            print("regressions:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+    return 0
+
+
+def _script_args() -> List[str]:
+    return sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+
+
+if __name__ == '__main__':
+    sys.exit(main(_script_args()))
@@ -0,0 +1,133 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# runs many build scripts in parallel `blender -b` processes.
+# this module doesn't depend on bpy so that this can be used from plain python:
+#   python build_farm.py jobs.json [--blender <path>] [--workers <n>] [--retries <n>]
+# where jobs.json is a list of {"blend_file": ..., "script": ..., "output": ..., "args": [...]}
+
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+
+class BuildJob:
+    def __init__(self, blend_file: str, script: str, output: str, args: Sequence[str] = ()):
+        self.blend_file: str = blend_file
+        self.script: str = script
+        self.output: str = output
+        self.args: List[str] = [*args]
+
+    def command(self, blender: str) -> List[str]:
+        # output is passed to ask_export with --anatawa12-output
+        return [
+            blender, "-b", self.blend_file,
+            "--python-exit-code", "1",
+            "--python", self.script,
+            "--", "--anatawa12-output", self.output, *self.args,
+        ]
+
+
+class BuildResult:
+    def __init__(self, job: BuildJob, exit_code: Optional[int], log: str, wall_time: float, attempts: int):
+        self.job: BuildJob = job
+        self.exit_code: Optional[int] = exit_code  # None if timed out
+        self.log: str = log
+        self.wall_time: float = wall_time  # sum of all attempts
+        self.attempts: int = attempts
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exit_code == 0
+
+
+def run_builds(
+        jobs: Sequence[BuildJob],
+        blender: str = "blender",
+        workers: Optional[int] = None,  # defaults to the count of cores
+        retries: int = 1,
+        timeout: Optional[float] = None,  # in seconds, per attempt
+) -> List[BuildResult]:
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda job: _run_job(job, blender, retries, timeout), jobs))
+
+
+def _run_job(job: BuildJob, blender: str, retries: int, timeout: Optional[float]) -> BuildResult:
+    logs: List[str] = []
+    wall_time = 0.0
+    exit_code: Optional[int] = None
+    attempt = 0
+    while attempt <= retries:
+        attempt += 1
+        start = time.perf_counter()
+        try:
+            process = subprocess.run(
+                job.command(blender),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=timeout,
+            )
+            exit_code = process.returncode
+            output = process.stdout
+        except subprocess.TimeoutExpired as e:
+            exit_code = None
+            output = e.stdout or b""
+        wall_time += time.perf_counter() - start
+        logs.append(f"==== attempt {attempt}: exit code {exit_code} ====\n")
+        logs.append(output.decode(errors="replace"))
+        if exit_code == 0:
+            break
+    return BuildResult(job, exit_code, "".join(logs), wall_time, attempt)
+
+
+def print_results(results: Sequence[BuildResult], file=sys.stdout):
+    for result in results:
+        status = "ok" if result.succeeded else f"FAILED ({result.exit_code})"
+        print(f"{status:<14} {result.wall_time:8.2f}s {result.attempts} attempt(s) {result.job.output}", file=file)
+    succeeded = len([r for r in results if r.succeeded])
+    print(f"{succeeded}/{len(results)} jobs succeeded", file=file)
+
+
+def main(argv: Sequence[str]) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="export many variants in parallel blender processes")
+    parser.add_argument("jobs", help="json file with list of jobs")
+    parser.add_argument("--blender", default="blender")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.jobs) as f:
+        jobs = [BuildJob(j["blend_file"], j["script"], j["output"], j.get("args", ())) for j in json.load(f)]
+
+    results = run_builds(jobs, args.blender, args.workers, args.retries, args.timeout)
+    for result in results:
+        if not result.succeeded:
+            print(f"log of {result.job.output}:", file=sys.stderr)
+            print(result.log, file=sys.stderr)
+    print_results(results)
+    return 0 if all(r.succeeded for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
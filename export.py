@@ -16,16 +16,47 @@
 import typing
 from typing import List, cast, Dict
 
+import bmesh
 import bpy
 import math
 import mathutils
+import numpy as np
 
-from bpy.types import Object, Collection, CollectionObjects
-from .utils import select_objects, copy_join, link_to_collection, merge_objects
+from bpy.types import Object, Collection, CollectionObjects, Mesh, VertexGroup, Armature, EditBone
+from .mesh_join import copy_join
+from .mesh_arrays import MeshArrays, invalidate
+from .utils import select_objects, link_to_collection, merge_objects, as_list, cached_flip_name
 from .freeze_modifiers import freeze_modifiers
+from .operator_context import OperatorContext
 
 
-def export_for_unity(objs: List[Object], path: str):
+def export_for_unity(objs: List[Object], path: str, use_cache: bool = False, use_stream_writer: bool = False):
+    """
+        export objs as fbx for unity.
+        if use_cache is True, export is skipped if fingerprint of objs is same as last export to path.
+        if use_stream_writer is True, objs without animation are written with fbx_stream_writer,
+        which uses much less memory than blender's exporter.
+    """
+    if not use_cache:
+        _export_for_unity(objs, path, use_stream_writer)
+        return
+
+    from .export_cache import fingerprint_objects, is_up_to_date, write_manifest
+    fingerprint = fingerprint_objects(objs, dict(_FBX_EXPORT_SETTINGS, use_stream_writer=use_stream_writer))
+    if is_up_to_date(path, fingerprint):
+        return
+    _export_for_unity(objs, path, use_stream_writer)
+    write_manifest(path, fingerprint)
+
+
+def _export_for_unity(objs: List[Object], path: str, use_stream_writer: bool):
+    if use_stream_writer:
+        from .fbx_stream_writer import stream_export_fbx, stream_unsupported_reason
+        reason = stream_unsupported_reason(objs)
+        if reason is None:
+            stream_export_fbx(objs, path, time=_FBX_EXPORT_SETTINGS["time"])
+            return
+        print(f"can't use stream writer: {reason}. fallback to blender's exporter")
     export_fbx(objs, path)
 
 
@@ -45,12 +76,98 @@ def rotate_on_x(objs: List[Object], theta: float) -> None:
     )
 
 
-def symmetrize_armature(obj: Object):
-    select_objects([obj])
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.armature.select_all(action='SELECT')
-    bpy.ops.armature.symmetrize()
-    bpy.ops.object.mode_set(mode='OBJECT')
+def symmetrize_armature(
+        obj: typing.Union[Object, typing.Iterable[Object]],
+        bones: typing.Optional[typing.Iterable[str]] = None,
+        direction: str = 'NEGATIVE_X',
+) -> Dict[str, int]:
+    """
+        mirror bones on one side of X axis to its left/right counterpart, like armature.symmetrize.
+        direction is 'NEGATIVE_X' to mirror -X side to +X side, or 'POSITIVE_X'.
+        bones limits bones to be mirrored. counterparts not exists are created.
+        returns count of mirrored bones for each armature.
+    """
+    objs = as_list(obj, Object)
+    for o in objs:
+        if not isinstance(o.data, Armature):
+            raise Exception(f"{o.name} is not armature")
+    if direction not in ('NEGATIVE_X', 'POSITIVE_X'):
+        raise Exception(f"unknown direction: {direction}")
+    subset = None if bones is None else set(bones)
+
+    mirrored: Dict[str, int] = {}
+    for o in objs:
+        with OperatorContext([o]) as context:
+            context.mode_set('EDIT')
+            mirrored[o.name] = _symmetrize_edit_bones(cast(Armature, o.data), subset, direction == 'NEGATIVE_X')
+    return mirrored
+
+
+def _symmetrize_edit_bones(armature: Armature, subset: typing.Optional[typing.Set[str]], from_negative: bool) -> int:
+    edit_bones = armature.edit_bones
+    names = [b.name for b in cast(List[EditBone], edit_bones)]
+    index_of = {name: i for i, name in enumerate(names)}
+    heads = _get_edit_bone_array(edit_bones, "head", 3)
+    tails = _get_edit_bone_array(edit_bones, "tail", 3)
+    rolls = _get_edit_bone_array(edit_bones, "roll", 1)
+    center_x = (heads[:, 0] + tails[:, 0]) / 2
+    is_source = center_x < 0 if from_negative else center_x > 0
+
+    # pairs of source and destination bone index. destination is created if not exists
+    pairs: List[typing.Tuple[int, int]] = []
+    for i, name in enumerate(names):
+        flipped = cached_flip_name(name)
+        if flipped == name or not is_source[i] or (subset is not None and name not in subset):
+            continue
+        j = index_of.get(flipped)
+        if j is None:
+            new_bone = edit_bones.new(flipped)
+            _copy_edit_bone_settings(cast(List[EditBone], edit_bones)[i], new_bone)
+            j = len(names)
+            names.append(new_bone.name)
+            index_of[new_bone.name] = j
+        elif is_source[j]:
+            # both are on source side: nothing to mirror from
+            continue
+        pairs.append((i, j))
+    if len(pairs) == 0:
+        return 0
+
+    source, destination = np.array(pairs, dtype=np.int64).T
+    flip_x = np.array([-1, 1, 1], dtype=np.float32)
+    heads = np.concatenate([heads, np.zeros((len(names) - len(heads), 3), dtype=np.float32)])
+    tails = np.concatenate([tails, np.zeros((len(names) - len(tails), 3), dtype=np.float32)])
+    rolls = np.concatenate([rolls, np.zeros(len(names) - len(rolls), dtype=np.float32)])
+    heads[destination] = heads[source] * flip_x
+    tails[destination] = tails[source] * flip_x
+    rolls[destination] = -rolls[source]
+    edit_bones.foreach_set("head", heads.ravel())
+    edit_bones.foreach_set("tail", tails.ravel())
+    edit_bones.foreach_set("roll", rolls)
+
+    bone_list = cast(List[EditBone], edit_bones)
+    for i, j in pairs:
+        src_bone = bone_list[i]
+        dst_bone = bone_list[j]
+        if src_bone.parent is None:
+            dst_bone.parent = None
+        else:
+            parent_name = cached_flip_name(src_bone.parent.name)
+            dst_bone.parent = cast(Dict[str, EditBone], edit_bones).get(parent_name, src_bone.parent)
+        dst_bone.use_connect = src_bone.use_connect
+    return len(pairs)
+
+
+def _get_edit_bone_array(edit_bones, attr: str, size: int) -> np.ndarray:
+    array = np.empty(len(edit_bones) * size, dtype=np.float32)
+    edit_bones.foreach_get(attr, array)
+    return array if size == 1 else array.reshape(-1, size)
+
+
+def _copy_edit_bone_settings(src: EditBone, dst: EditBone):
+    for attr in ("use_deform", "use_inherit_rotation", "inherit_scale", "use_local_location", "use_relative_parent",
+                 "envelope_distance", "envelope_weight", "head_radius", "tail_radius", "bbone_segments", "layers"):
+        setattr(dst, attr, getattr(src, attr))
 
 
 def apply_transform(obj: Object):
@@ -67,60 +184,165 @@ def apply_transform(obj: Object):
     obj.matrix_basis = mathutils.Matrix.Identity(4)  # type: ignore
 
 
+def apply_transforms(obj: typing.Union[Object, typing.Iterable[Object]]) -> int:
+    """
+        apply basis transform of objects to its data, like apply_transform for many objects at once.
+        if obj is one object, it and all its descendants are applied.
+        children keep world matrix through matrix_parent_inverse. returns count of applied objects.
+    """
+    objs = [obj, *cast(typing.Iterable[Object], obj.children_recursive)] if isinstance(obj, Object) else [*obj]
+    basis_of: Dict[str, np.ndarray] = {}
+    for o in objs:
+        basis = np.array(o.matrix_basis, dtype=np.float64)
+        if np.allclose(basis, np.identity(4)):
+            continue
+        if o.data is not None and o.data.users > 1:
+            raise Exception(f"data of {o.name} is used by multiple objects")
+        basis_of[o.name] = basis
+
+    for o in objs:
+        basis = basis_of.get(o.name)
+        if basis is None:
+            continue
+        if isinstance(o.data, bpy.types.Mesh):
+            _transform_mesh(o.data, basis)
+        elif hasattr(o.data, "transform"):
+            o.data.transform(mathutils.Matrix(basis.tolist()))  # type: ignore
+        else:
+            print("can't transform: " + str(o) + " (" + str(type(o.data)) + ")")
+        for c in cast(typing.Iterable[Object], o.children):
+            c.matrix_parent_inverse = mathutils.Matrix((basis @ np.array(c.matrix_parent_inverse)).tolist())
+        o.matrix_basis = mathutils.Matrix.Identity(4)  # type: ignore
+    return len(basis_of)
+
+
+def _transform_mesh(mesh: Mesh, matrix: np.ndarray):
+    """transform vertices, shape keys and custom normals of mesh with matrix"""
+    linear = matrix[:3, :3]
+    offset = matrix[:3, 3]
+    normals: typing.Optional[np.ndarray] = None
+    if mesh.has_custom_normals:
+        mesh.calc_normals_split()
+        normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+        mesh.loops.foreach_get("normal", normals)
+        normals = normals.reshape(-1, 3) @ np.linalg.inv(linear)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        normals /= np.where(lengths == 0, 1, lengths)
+
+    def transform(collection):
+        co = np.empty(len(collection) * 3, dtype=np.float32)
+        collection.foreach_get("co", co)
+        collection.foreach_set("co", (co.reshape(-1, 3) @ linear.T + offset).astype(np.float32).ravel())
+
+    arrays = MeshArrays.of(mesh)
+    arrays.co[:] = arrays.co @ linear.T + offset
+    arrays.write_co()
+    if mesh.shape_keys is not None:
+        for key in mesh.shape_keys.key_blocks:
+            transform(key.data)
+    if normals is not None:
+        mesh.normals_split_custom_set(normals)
+
+
 def hide_all(objs):
     for o in objs:
         o.hide_set(False)
 
 
+# settings of export_for_unity. this is also part of fingerprint of export cache
+_FBX_EXPORT_SETTINGS = dict(
+    # Include
+    use_selection=True,
+    use_visible=False,
+    use_active_collection=False,
+    object_types={'ARMATURE', 'MESH'},
+    use_custom_props=False,
+    # Transform
+    global_scale=1.0,
+    apply_scale_options='FBX_SCALE_ALL',
+    axis_forward='-Z',
+    axis_up='Y',
+    apply_unit_scale=True,  # Apply Unit
+    use_space_transform=True,  # Use Space Transform
+    bake_space_transform=True,  # Apply Transform
+    # Geometry
+    mesh_smooth_type='OFF',
+    use_subsurf=False,
+    use_mesh_modifiers=True,  # Apply Modifiers
+    use_mesh_edges=False,  # Loose Edges
+    use_triangles=False,  # Triangulate Faces
+    use_tspace=False,  # Tangent Space
+    # Armature
+    primary_bone_axis='Y',
+    secondary_bone_axis='X',
+    armature_nodetype='NULL',  # Armature FBXNode Type
+    use_armature_deform_only=False,  # Only Deform Bones
+    add_leaf_bones=False,  # Add Leaf Bones
+    # Bake Animation
+    bake_anim=True,
+    bake_anim_use_all_bones=True,  # Key All Bones
+    bake_anim_use_nla_strips=True,  # NLA Strips
+    bake_anim_use_all_actions=True,  # All Actions
+    bake_anim_force_startend_keying=True,  # Force Start/End Keying
+    bake_anim_step=1.0,  # Sampling Rate
+    bake_anim_simplify_factor=1.0,  # Simplify
+    # Anatawa12's part
+    time="1970-01-01T00:00:00+00:00:00",
+)
+
+
 def export_fbx(objs, path):
     select_objects(objs)
     from .our_export_fbx_bin import export_fbx
-    export_fbx(
-        # General
-        filepath=path,
-        # Include
-        use_selection=True,
-        use_visible=False,
-        use_active_collection=False,
-        object_types={'ARMATURE', 'MESH'},
-        use_custom_props=False,
-        # Transform
-        global_scale=1.0,
-        apply_scale_options='FBX_SCALE_ALL',
-        axis_forward='-Z',
-        axis_up='Y',
-        apply_unit_scale=True,  # Apply Unit
-        use_space_transform=True,  # Use Space Transform
-        bake_space_transform=True,  # Apply Transform
-        # Geometry
-        mesh_smooth_type='OFF',
-        use_subsurf=False,
-        use_mesh_modifiers=True,  # Apply Modifiers
-        use_mesh_edges=False,  # Loose Edges
-        use_triangles=False,  # Triangulate Faces
-        use_tspace=False,  # Tangent Space
-        # Armature
-        primary_bone_axis='Y',
-        secondary_bone_axis='X',
-        armature_nodetype='NULL',  # Armature FBXNode Type
-        use_armature_deform_only=False,  # Only Deform Bones
-        add_leaf_bones=False,  # Add Leaf Bones
-        # Bake Animation
-        bake_anim=True,
-        bake_anim_use_all_bones=True,  # Key All Bones
-        bake_anim_use_nla_strips=True,  # NLA Strips
-        bake_anim_use_all_actions=True,  # All Actions
-        bake_anim_force_startend_keying=True,  # Force Start/End Keying
-        bake_anim_step=1.0,  # Sampling Rate
-        bake_anim_simplify_factor=1.0,  # Simplify
-        # Anatawa12's part
-        time="1970-01-01T00:00:00+00:00:00",
-    )
+    export_fbx(filepath=path, **_FBX_EXPORT_SETTINGS)
+
+
+def merge_by_distance(
+        obj: typing.Union[Object, typing.Iterable[Object]],
+        threshold: float = 0.0001,
+        vertex_group: typing.Optional[str] = None,
+        mask: typing.Union[np.ndarray, Dict[str, np.ndarray], None] = None,
+) -> Dict[str, int]:
+    """
+        merge vertices closer than threshold on mesh data, without entering edit mode.
+        merged vertices can be limited to vertex_group and to mask, bool array of vertices or dict of object name
+        to bool array. shape keys and custom normals are kept by bmesh.
+        returns count of merged vertices for each object.
+    """
+    objs = as_list(obj, Object)
+    merged: Dict[str, int] = {}
+    for o in objs:
+        mesh = o.data
+        if not isinstance(mesh, Mesh):
+            raise Exception("object is not mesh")
+        if o.mode == 'EDIT':
+            raise Exception(f"{o.name} is in edit mode")
 
+        targets = np.ones(len(mesh.vertices), dtype=bool)
+        if vertex_group is not None:
+            group = cast(Dict[str, VertexGroup], o.vertex_groups).get(vertex_group)
+            if group is None:
+                raise Exception(f"Vertex group {vertex_group} not found on {o.name}")
+            targets = MeshArrays.of(mesh).vertices_in_group(group.index)
+        object_mask = mask.get(o.name) if isinstance(mask, dict) else mask
+        if object_mask is not None:
+            if len(object_mask) != len(mesh.vertices):
+                raise Exception(f"mask size mismatch on {o.name}: {len(object_mask)}, {len(mesh.vertices)}")
+            targets &= np.asarray(object_mask, dtype=bool)
 
-def merge_by_distance(obj: Object, threshold=0.0001):
-    select_objects([obj])
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.mesh.remove_doubles(threshold=threshold)
-    bpy.ops.object.mode_set(mode='OBJECT')
+        bm = bmesh.new()
+        try:
+            bm.from_mesh(mesh)
+            bm.verts.ensure_lookup_table()
+            before = len(bm.verts)
+            bmesh.ops.remove_doubles(bm, verts=[bm.verts[i] for i in np.flatnonzero(targets).tolist()],
+                                     dist=threshold)
+            merged[o.name] = before - len(bm.verts)
+            if merged[o.name] != 0:
+                bm.to_mesh(mesh)
+        finally:
+            bm.free()
+        if merged[o.name] != 0:
+            mesh.update()
+            invalidate(mesh)
+    return merged
@@ -0,0 +1,275 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# fingerprint of export inputs to skip exports whose output won't change.
+# the fbx exporter is deterministic with fixed time so same fingerprint means same output.
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, cast
+
+import bpy
+import numpy as np
+from bpy.types import Action, AnimData, Armature, Bone, DriverTarget, DriverVariable, FCurve, FModifier, Material, \
+    Mesh, Modifier, NlaStrip, NlaTrack, Object, PoseBone, ShapeKey, VertexGroup
+from .utils import read_vertex_weights
+
+# increase this when the fingerprint is changed
+_FINGERPRINT_VERSION = 3
+
+
+def fingerprint_objects(objs: Iterable[Object], settings: Optional[Dict[str, Any]] = None) -> str:
+    """fingerprint of objects, its data, materials, all actions and export settings"""
+    h = hashlib.sha256()
+    _hash_scene(h)
+    if settings is not None:
+        _update(h, "settings", json.dumps(_normalize(settings), sort_keys=True))
+    for obj in sorted(objs, key=lambda o: o.name):
+        _hash_object(h, obj)
+    _hash_actions(h)
+    return h.hexdigest()
+
+
+def fingerprint_environment() -> str:
+    """fingerprint of scene settings and all actions, the part of fingerprint_objects shared by all objects"""
+    h = hashlib.sha256()
+    _hash_scene(h)
+    _hash_actions(h)
+    return h.hexdigest()
+
+
+def fingerprint_object(obj: Object) -> str:
+    """fingerprint of obj, its data and materials. combine with fingerprint_environment for animated objects"""
+    h = hashlib.sha256()
+    _update(h, "version", _FINGERPRINT_VERSION)
+    _hash_object(h, obj)
+    return h.hexdigest()
+
+
+def _hash_scene(h):
+    _update(h, "version", _FINGERPRINT_VERSION, bpy.app.version, _fbx_addon_version())
+    scene = bpy.context.scene
+    _update(h, "unit", scene.unit_settings.system, scene.unit_settings.scale_length)
+    _update(h, "frames", scene.render.fps, scene.render.fps_base, scene.frame_start, scene.frame_end, scene.frame_step)
+
+
+def _hash_actions(h):
+    for action in sorted(cast(Iterable[Action], bpy.data.actions), key=lambda a: a.name):
+        _hash_action(h, action)
+
+
+def is_up_to_date(path: str, fingerprint: str) -> bool:
+    manifest = _read_manifest(path)
+    if manifest is None or manifest.get("fingerprint") != fingerprint:
+        return False
+    return os.path.isfile(path) and os.path.getsize(path) == manifest.get("size")
+
+
+def write_manifest(path: str, fingerprint: str):
+    with open(_manifest_path(path), "w") as f:
+        json.dump({"fingerprint": fingerprint, "size": os.path.getsize(path)}, f)
+
+
+def _manifest_path(path: str) -> str:
+    return path + ".cache.json"
+
+
+def _read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_manifest_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _fbx_addon_version():
+    import io_scene_fbx
+    return io_scene_fbx.bl_info["version"]
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, (set, frozenset)):
+        return sorted(_normalize(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _update(h, *values: Any):
+    h.update(repr(values).encode())
+
+
+def _update_array(h, collection, attr: str, dtype, size: int = 1):
+    array = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, array)
+    _update(h, attr, len(array))
+    h.update(array.tobytes())
+
+
+def _update_matrix(h, matrix):
+    _update(h, [tuple(row) for row in matrix])
+
+
+# properties only for UI, which don't change the output
+_UI_PROPERTIES = {"show_expanded", "is_active", "active", "select"}
+
+
+def _update_rna(h, struct):
+    """hashes non-collection properties of struct. pointers are hashed with its name"""
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == "rna_type" or prop.type == 'COLLECTION' or prop.identifier in _UI_PROPERTIES \
+                or prop.identifier.startswith("show_expanded"):
+            continue
+        value = getattr(struct, prop.identifier)
+        if prop.type == 'POINTER':
+            value = getattr(value, "name", None)
+        elif prop.type == 'ENUM' and prop.is_enum_flag:
+            # set of enum flag is iterated in random order
+            value = tuple(sorted(value))
+        elif hasattr(value, "__len__") and not isinstance(value, str):
+            value = tuple(value)
+        _update(h, prop.identifier, value)
+
+
+def _hash_object(h, obj: Object):
+    _update(h, "object", obj.name, obj.type, obj.parent.name if obj.parent else None, obj.parent_type, obj.parent_bone)
+    _update_matrix(h, obj.matrix_world)
+    _update(h, "vertex groups", [g.name for g in cast(List[VertexGroup], obj.vertex_groups)])
+    for modifier in cast(List[Modifier], obj.modifiers):
+        _update(h, "modifier")
+        _update_rna(h, modifier)
+    for slot in obj.material_slots:
+        _update(h, "slot", slot.link)
+        if slot.material is not None:
+            _hash_material(h, slot.material)
+
+    data = obj.data
+    if isinstance(data, Mesh):
+        _hash_mesh(h, data)
+    elif isinstance(data, Armature):
+        _hash_armature(h, data)
+    if obj.pose is not None:
+        for pose_bone in cast(List[PoseBone], obj.pose.bones):
+            _update(h, "pose bone", pose_bone.name)
+            _update_matrix(h, pose_bone.matrix_basis)
+    _hash_animation_data(h, obj.animation_data)
+    if isinstance(data, Mesh) and data.shape_keys is not None:
+        _hash_animation_data(h, data.shape_keys.animation_data)
+    elif isinstance(data, Armature):
+        _hash_animation_data(h, data.animation_data)
+
+
+def _hash_mesh(h, mesh: Mesh):
+    _update(h, "mesh", mesh.name, mesh.use_auto_smooth, mesh.auto_smooth_angle, mesh.has_custom_normals)
+    _update_array(h, mesh.vertices, "co", np.float32, 3)
+    _update_array(h, mesh.edges, "vertices", np.int32, 2)
+    _update_array(h, mesh.loops, "vertex_index", np.int32)
+    _update_array(h, mesh.loops, "edge_index", np.int32)
+    _update_array(h, mesh.polygons, "loop_start", np.int32)
+    _update_array(h, mesh.polygons, "loop_total", np.int32)
+    _update_array(h, mesh.polygons, "material_index", np.int32)
+    _update_array(h, mesh.polygons, "use_smooth", bool)
+    if mesh.has_custom_normals:
+        mesh.calc_normals_split()
+        _update_array(h, mesh.loops, "normal", np.float32, 3)
+    for uv_layer in mesh.uv_layers:
+        _update(h, "uv", uv_layer.name, uv_layer.active_render)
+        _update_array(h, uv_layer.data, "uv", np.float32, 2)
+    for color_layer in mesh.vertex_colors:
+        _update(h, "color", color_layer.name)
+        _update_array(h, color_layer.data, "color", np.float32, 4)
+    if mesh.shape_keys is not None:
+        for key in cast(List[ShapeKey], mesh.shape_keys.key_blocks):
+            _update(h, "shape key", key.name, key.relative_key.name, key.value, key.mute, key.vertex_group,
+                    key.slider_min, key.slider_max)
+            _update_array(h, key.data, "co", np.float32, 3)
+    for group, (indices, weights) in sorted(read_vertex_weights(mesh).items()):
+        _update(h, "weights", group)
+        h.update(indices.tobytes())
+        h.update(weights.tobytes())
+    _update(h, "materials", [m.name if m is not None else None for m in cast(List[Material], mesh.materials)])
+
+
+def _hash_armature(h, armature: Armature):
+    bones = cast(List[Bone], armature.bones)
+    _update(h, "armature", armature.name, [(b.name, b.parent.name if b.parent else None, b.use_deform, b.use_connect)
+                                           for b in bones])
+    _update_array(h, bones, "head_local", np.float32, 3)
+    _update_array(h, bones, "tail_local", np.float32, 3)
+    _update_array(h, bones, "matrix_local", np.float32, 16)
+
+
+def _hash_material(h, material: Material):
+    _update(h, "material", material.name, material.use_nodes, tuple(material.diffuse_color))
+    if material.node_tree is None:
+        return
+    for node in material.node_tree.nodes:
+        image = getattr(node, "image", None)
+        _update(h, "node", node.name, node.bl_idname, image.filepath if image is not None else None)
+        for socket in node.inputs:
+            value = getattr(socket, "default_value", None)
+            if hasattr(value, "__len__"):
+                value = tuple(value)
+            _update(h, socket.identifier, value)
+    for link in material.node_tree.links:
+        _update(h, "link", link.from_node.name, link.from_socket.identifier, link.to_node.name,
+                link.to_socket.identifier)
+
+
+def _hash_animation_data(h, animation_data: Optional[AnimData]):
+    """assigned action, nla tracks and drivers"""
+    if animation_data is None:
+        return
+    _update(h, "animation data")
+    _update_rna(h, animation_data)
+    for track in cast(List[NlaTrack], animation_data.nla_tracks):
+        _update(h, "nla track")
+        _update_rna(h, track)
+        for strip in cast(List[NlaStrip], track.strips):
+            _update(h, "nla strip")
+            _update_rna(h, strip)
+    for driver_curve in cast(List[FCurve], animation_data.drivers):
+        _hash_fcurve(h, driver_curve)
+        driver = driver_curve.driver
+        _update(h, "driver", driver.type, driver.expression, driver.use_self)
+        for variable in cast(List[DriverVariable], driver.variables):
+            _update(h, "variable", variable.name, variable.type)
+            for target in cast(List[DriverTarget], variable.targets):
+                _update_rna(h, target)
+
+
+def _hash_action(h, action: Action):
+    _update(h, "action", action.name, tuple(action.frame_range))
+    for fcurve in cast(List[FCurve], action.fcurves):
+        _hash_fcurve(h, fcurve)
+
+
+def _hash_fcurve(h, fcurve: FCurve):
+    _update(h, "fcurve", fcurve.data_path, fcurve.array_index, fcurve.mute, fcurve.extrapolation)
+    _update_array(h, fcurve.keyframe_points, "co", np.float32, 2)
+    _update_array(h, fcurve.keyframe_points, "handle_left", np.float32, 2)
+    _update_array(h, fcurve.keyframe_points, "handle_right", np.float32, 2)
+    # enums are read as its index
+    _update_array(h, fcurve.keyframe_points, "interpolation", np.int32)
+    _update_array(h, fcurve.keyframe_points, "easing", np.int32)
+    _update_array(h, fcurve.keyframe_points, "amplitude", np.float32)
+    _update_array(h, fcurve.keyframe_points, "back", np.float32)
+    _update_array(h, fcurve.keyframe_points, "period", np.float32)
+    for modifier in cast(List[FModifier], fcurve.modifiers):
+        _update(h, "fcurve modifier")
+        _update_rna(h, modifier)
@@ -1,41 +1,41 @@
-import typing
-from typing import Dict, cast, List, Optional, Set
+from typing import Dict, cast, Iterable, List, Union
 
-import bpy
-from bpy.types import Object, Mesh, MeshPolygon, Material, IDMaterials, BlendDataMaterials, MeshUVLoop, UVLoopLayers, VertexGroup, MeshVertex, VertexGroupElement
+import numpy as np
+from bpy.types import Object, Mesh, VertexGroup
+
+from .mesh_arrays import MeshArrays
+from .utils import as_list, delete_faces, polygons_all_of
 
-from .utils import UVRegion
-from .export import select_objects
 
 def remove_face_of_group(
-        obj: Object,
-        vertex_group: str,
-):
-    mesh = obj.data
-    if not isinstance(mesh, Mesh):
-        raise Exception("object is not mesh")
-
-    vertex_group_idx = cast(Dict[str, VertexGroup], obj.vertex_groups)[vertex_group].index
-    vertices: Set[int] = set()
-
-    for v in cast(List[MeshVertex], mesh.vertices):
-        for g in cast(List[VertexGroupElement],  v.groups):
-            if g.group == vertex_group_idx:
-                vertices.add(v.index)
-                break
-
-    for poly in cast(List[MeshPolygon], mesh.polygons):
-        poly.select = False
-        for v in cast(List[MeshVertex], poly.vertices):
-            if v not in vertices:
-                break
-        else:
-            # if all elements are in vertex_group
-            poly.select = True
-        pass
-
-    # remove selected faces
-    select_objects([obj])
-    bpy.ops.object.mode_set_with_submode(mode='EDIT', mesh_select_mode={'FACE'})
-    bpy.ops.mesh.delete(type='FACE')
-    bpy.ops.object.mode_set(mode='OBJECT')
+        obj: Union[Object, Iterable[Object]],
+        vertex_group: Union[str, Iterable[str]],
+) -> Dict[str, int]:
+    """
+        remove faces whose all vertices are in one of vertex groups.
+        returns count of removed faces for each object.
+    """
+    objs = as_list(obj, Object)
+    vertex_groups = as_list(vertex_group, str)
+    removed: Dict[str, int] = {}
+
+    for o in objs:
+        mesh = o.data
+        if not isinstance(mesh, Mesh):
+            raise Exception("object is not mesh")
+
+        group_indices: List[int] = []
+        for name in vertex_groups:
+            group = cast(Dict[str, VertexGroup], o.vertex_groups).get(name)
+            if group is None:
+                raise Exception(f"Vertex group {name} not found on {o.name}")
+            group_indices.append(group.index)
+
+        arrays = MeshArrays.of(mesh)
+        face_mask = np.zeros(len(arrays.loop_starts), dtype=bool)
+        for group_index in group_indices:
+            in_group = arrays.vertices_in_group(group_index)
+            face_mask |= polygons_all_of(in_group[arrays.loop_vertices], arrays.loop_starts, arrays.loop_totals)
+
+        removed[o.name] = delete_faces(mesh, face_mask)
+    return removed
@@ -0,0 +1,653 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# fbx binary writer for meshes, armatures, skin weights, shape keys and materials without animation.
+# nodes are written to the file as soon as they are created, and the end offset of each node
+# is patched when the node is closed, so no element tree is kept in memory.
+# the output is in the same space as export_for_unity: -Z forward, Y up, FBX_SCALE_ALL, baked space transform.
+
+import datetime
+import math
+import zlib
+from contextlib import contextmanager
+from struct import pack
+from typing import BinaryIO, Callable, Dict, List, Optional, Sequence, Set, Tuple, cast
+
+import bpy
+import numpy as np
+from bpy.types import Armature, ArmatureModifier, Bone, Material, Mesh, Object, PoseBone, ShapeKey, VertexGroup
+from bpy_extras.io_utils import axis_conversion
+from mathutils import Matrix
+from .our_export_fbx_bin import _UUIDRegistry
+from .utils import polygon_loop_indices, read_loop_vertices, read_material_indices, read_polygon_loops, \
+    read_vertex_weights
+
+_FBX_VERSION = 7400
+_HEAD_MAGIC = b'Kaydara FBX Binary\x20\x20\x00\x1a\x00'
+_BLOCK_SENTINEL = b'\x00' * 13
+_FILE_ID = b'\x28\xb3\x2a\xeb\xb6\x24\xcc\xc2\xbf\xc8\xb0\x2a\xa9\x2b\xfc\xf1'
+_TIME_ID = '1970-01-01 10:00:00:000'
+_FOOT_ID = b'\xfa\xbc\xab\x09\xd0\xc8\xd4\x66\xb1\x76\xfb\x83\x1c\xf7\x26\x7e'
+_FOOT_MAGIC = b'\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b'
+
+# arrays smaller than this are not compressed
+_ARRAY_COMPRESS_MIN = 128
+# count of array elements compressed at once
+_ARRAY_CHUNK = 1 << 16
+
+_CREATOR = "anatawa12's library FBX stream writer"
+
+Prop = Callable[[BinaryIO], None]
+
+
+def _int32(value: int) -> Prop:
+    return lambda f: f.write(b'I' + pack('<i', value))
+
+
+def _int64(value: int) -> Prop:
+    return lambda f: f.write(b'L' + pack('<q', value))
+
+
+def _float64(value: float) -> Prop:
+    return lambda f: f.write(b'D' + pack('<d', value))
+
+
+def _bool(value: bool) -> Prop:
+    return lambda f: f.write(b'C' + pack('<?', value))
+
+
+def _string(value: str) -> Prop:
+    data = value.encode()
+    return lambda f: f.write(b'S' + pack('<I', len(data)) + data)
+
+
+def _name(name: str, cls: str) -> Prop:
+    """object name in fbx binary: name\\x00\\x01class"""
+    data = name.encode() + b'\x00\x01' + cls.encode()
+    return lambda f: f.write(b'S' + pack('<I', len(data)) + data)
+
+
+def _raw(data: bytes) -> Prop:
+    return lambda f: f.write(b'R' + pack('<I', len(data)) + data)
+
+
+def _array(code: bytes, dtype: str, values) -> Prop:
+    def write(f: BinaryIO):
+        data = np.ascontiguousarray(values, dtype=dtype).ravel()
+        header = f.tell()
+        if data.nbytes < _ARRAY_COMPRESS_MIN:
+            f.write(code + pack('<3I', len(data), 0, data.nbytes))
+            f.write(data.tobytes())
+            return
+        f.write(code + pack('<3I', len(data), 1, 0))
+        start = f.tell()
+        compressor = zlib.compressobj()
+        for i in range(0, len(data), _ARRAY_CHUNK):
+            f.write(compressor.compress(data[i:i + _ARRAY_CHUNK]))
+        f.write(compressor.flush())
+        end = f.tell()
+        f.seek(header + 9)
+        f.write(pack('<I', end - start))
+        f.seek(end)
+    return write
+
+
+def _int32_array(values) -> Prop:
+    return _array(b'i', '<i4', values)
+
+
+def _float64_array(values) -> Prop:
+    return _array(b'd', '<f8', values)
+
+
+class _NodeWriter:
+    def __init__(self, file: BinaryIO):
+        self._file = file
+        # header offset, property count and if the node has children for each open node
+        self._stack: List[List[int]] = []
+
+    def begin(self, name: str, *props: Prop):
+        f = self._file
+        if len(self._stack) != 0:
+            self._stack[-1][2] = True
+        header = f.tell()
+        encoded = name.encode()
+        f.write(pack('<3IB', 0, 0, 0, len(encoded)))
+        f.write(encoded)
+        props_start = f.tell()
+        for prop in props:
+            prop(f)
+        props_end = f.tell()
+        f.seek(header + 4)
+        f.write(pack('<2I', len(props), props_end - props_start))
+        f.seek(props_end)
+        self._stack.append([header, len(props), False])
+
+    def end(self):
+        f = self._file
+        header, prop_count, has_children = self._stack.pop()
+        if has_children or prop_count == 0:
+            f.write(_BLOCK_SENTINEL)
+        end = f.tell()
+        f.seek(header)
+        f.write(pack('<I', end))
+        f.seek(end)
+
+    @contextmanager
+    def node(self, name: str, *props: Prop):
+        self.begin(name, *props)
+        yield
+        self.end()
+
+    def leaf(self, name: str, *props: Prop):
+        self.begin(name, *props)
+        self.end()
+
+    def p(self, name: str, type_name: str, label: str, flags: str, *values: Prop):
+        """property of Properties70"""
+        self.leaf("P", _string(name), _string(type_name), _string(label), _string(flags), *values)
+
+
+def stream_unsupported_reason(objs: Sequence[Object]) -> Optional[str]:
+    """reason why objs can't be written by stream writer, or None if supported"""
+    if len(bpy.data.actions) != 0:
+        return "there are actions"
+    for obj in objs:
+        if obj.type not in {'MESH', 'ARMATURE'}:
+            continue
+        if obj.animation_data is not None:
+            return f"{obj.name} has animation data"
+        if obj.type == 'MESH':
+            for modifier in obj.modifiers:
+                if modifier.type != 'ARMATURE' and modifier.show_viewport:
+                    return f"{obj.name} has {modifier.type} modifier"
+            shape_keys = cast(Mesh, obj.data).shape_keys
+            if shape_keys is not None and shape_keys.animation_data is not None:
+                return f"shape keys of {obj.name} has animation data"
+    return None
+
+
+def stream_export_fbx(objs: Sequence[Object], filepath: str, time: Optional[str] = None):
+    time_value = datetime.datetime.fromisoformat(time) if time is not None else datetime.datetime.now()
+    objs = [o for o in objs if o.type in {'MESH', 'ARMATURE'}]
+    with open(filepath, 'wb') as f:
+        _SceneWriter(_NodeWriter(f), objs, filepath, time_value).write(f)
+
+
+class _SceneWriter:
+    def __init__(self, w: _NodeWriter, objs: List[Object], filepath: str, time: datetime.datetime):
+        self.w = w
+        self.objs = objs
+        self.filepath = filepath
+        self.time = time
+        self.registry = _UUIDRegistry()
+        self.connections: List[Tuple[int, int]] = []  # child, parent
+
+        space = axis_conversion(to_forward='-Z', to_up='Y').to_4x4()
+        self.space: Matrix = space
+        self.space_inv: Matrix = space.inverted()
+        self.space_rotation = np.array(space.to_3x3(), dtype=np.float64)
+
+        # names of exported objects. parents not exported are not written as parent model
+        self.object_set = set(o.name for o in objs)
+        self.bind_poses: List[Tuple[int, Matrix]] = []
+        self.counts: Dict[str, int] = {}
+        self.written_materials: Set[int] = set()
+
+    def uid(self, key: str) -> int:
+        return int(self.registry.fbx_uuid_from_key(key))
+
+    def fbx_space(self, matrix: Matrix) -> Matrix:
+        return self.space @ matrix @ self.space_inv
+
+    def count(self, object_type: str, count: int = 1):
+        if count != 0:
+            self.counts[object_type] = self.counts.get(object_type, 0) + count
+
+    def write(self, f: BinaryIO):
+        f.write(_HEAD_MAGIC)
+        f.write(pack('<I', _FBX_VERSION))
+        self.write_header()
+        self.write_global_settings()
+        self.write_documents()
+        self.w.leaf("References")
+        self.write_definitions()
+        self.write_objects()
+        self.write_connections()
+        with self.w.node("Takes"):
+            self.w.leaf("Current", _string(""))
+        f.write(_BLOCK_SENTINEL)
+        self.write_footer(f)
+
+    def write_header(self):
+        w = self.w
+        with w.node("FBXHeaderExtension"):
+            w.leaf("FBXHeaderVersion", _int32(1003))
+            w.leaf("FBXVersion", _int32(_FBX_VERSION))
+            w.leaf("EncryptionType", _int32(0))
+            with w.node("CreationTimeStamp"):
+                w.leaf("Version", _int32(1000))
+                w.leaf("Year", _int32(self.time.year))
+                w.leaf("Month", _int32(self.time.month))
+                w.leaf("Day", _int32(self.time.day))
+                w.leaf("Hour", _int32(self.time.hour))
+                w.leaf("Minute", _int32(self.time.minute))
+                w.leaf("Second", _int32(self.time.second))
+                w.leaf("Millisecond", _int32(self.time.microsecond // 1000))
+            w.leaf("Creator", _string(_CREATOR))
+            with w.node("SceneInfo", _name("GlobalInfo", "SceneInfo"), _string("UserData")):
+                w.leaf("Type", _string("UserData"))
+                w.leaf("Version", _int32(100))
+                with w.node("MetaData"):
+                    w.leaf("Version", _int32(100))
+                    for key in ("Title", "Subject", "Author", "Keywords", "Revision", "Comment"):
+                        w.leaf(key, _string(""))
+                with w.node("Properties70"):
+                    w.p("DocumentUrl", "KString", "Url", "", _string(self.filepath))
+                    w.p("SrcDocumentUrl", "KString", "Url", "", _string(self.filepath))
+        w.leaf("FileId", _raw(_FILE_ID))
+        w.leaf("CreationTime", _string(_TIME_ID))
+        w.leaf("Creator", _string(_CREATOR))
+
+    def write_global_settings(self):
+        w = self.w
+        fps = bpy.context.scene.render.fps / bpy.context.scene.render.fps_base
+        with w.node("GlobalSettings"):
+            w.leaf("Version", _int32(1000))
+            with w.node("Properties70"):
+                w.p("UpAxis", "int", "Integer", "", _int32(1))
+                w.p("UpAxisSign", "int", "Integer", "", _int32(1))
+                w.p("FrontAxis", "int", "Integer", "", _int32(2))
+                w.p("FrontAxisSign", "int", "Integer", "", _int32(1))
+                w.p("CoordAxis", "int", "Integer", "", _int32(0))
+                w.p("CoordAxisSign", "int", "Integer", "", _int32(1))
+                w.p("OriginalUpAxis", "int", "Integer", "", _int32(-1))
+                w.p("OriginalUpAxisSign", "int", "Integer", "", _int32(1))
+                # FBX_SCALE_ALL with applied unit scale
+                unit_scale = bpy.context.scene.unit_settings.scale_length * 100.0
+                w.p("UnitScaleFactor", "double", "Number", "", _float64(unit_scale))
+                w.p("OriginalUnitScaleFactor", "double", "Number", "", _float64(unit_scale))
+                w.p("AmbientColor", "ColorRGB", "Color", "", _float64(0), _float64(0), _float64(0))
+                w.p("DefaultCamera", "KString", "", "", _string("Producer Perspective"))
+                w.p("TimeMode", "enum", "", "", _int32(14))  # custom frame rate
+                w.p("TimeSpanStart", "KTime", "Time", "", _int64(0))
+                w.p("TimeSpanStop", "KTime", "Time", "", _int64(46186158000))  # one second
+                w.p("CustomFrameRate", "double", "Number", "", _float64(fps))
+
+    def write_documents(self):
+        w = self.w
+        with w.node("Documents"):
+            w.leaf("Count", _int32(1))
+            with w.node("Document", _int64(self.uid("__FBX_Document__")), _string("Scene"), _string("Scene")):
+                with w.node("Properties70"):
+                    w.p("SourceObject", "object", "", "")
+                    w.p("ActiveAnimStackName", "KString", "", "", _string(""))
+                w.leaf("RootNode", _int64(0))
+
+    def count_objects(self):
+        """counts objects written by write_objects"""
+        materials = set()
+        for obj in self.objs:
+            if obj.type == 'ARMATURE':
+                bone_count = len(cast(Armature, obj.data).bones)
+                self.count("Model", 1 + bone_count)
+                self.count("NodeAttribute", 1 + bone_count)
+            elif obj.type == 'MESH':
+                mesh = cast(Mesh, obj.data)
+                self.count("Model")
+                self.count("Geometry")
+                materials.update(m.name for m in self.materials_of(obj))
+                armature_obj = self.skin_armature_of(obj)
+                if armature_obj is not None:
+                    bones = cast(Dict[str, Bone], cast(Armature, armature_obj.data).bones)
+                    self.count("Deformer", 1 + len(self.cluster_groups_of(obj, bones)))
+                if mesh.shape_keys is not None and len(mesh.shape_keys.key_blocks) > 1:
+                    shape_count = len(mesh.shape_keys.key_blocks) - 1
+                    self.count("Geometry", shape_count)
+                    self.count("Deformer", 1 + shape_count)
+        self.count("Material", len(materials))
+        if len(self.objs) != 0:
+            self.count("Pose")
+
+    def write_definitions(self):
+        w = self.w
+        self.count_objects()
+        with w.node("Definitions"):
+            w.leaf("Version", _int32(100))
+            w.leaf("Count", _int32(1 + sum(self.counts.values())))
+            with w.node("ObjectType", _string("GlobalSettings")):
+                w.leaf("Count", _int32(1))
+            for object_type, count in self.counts.items():
+                with w.node("ObjectType", _string(object_type)):
+                    w.leaf("Count", _int32(count))
+
+    def write_connections(self):
+        w = self.w
+        with w.node("Connections"):
+            for child, parent in self.connections:
+                w.leaf("C", _string("OO"), _int64(child), _int64(parent))
+
+    @staticmethod
+    def write_footer(f: BinaryIO):
+        f.write(_FOOT_ID)
+        f.write(b'\x00' * 4)
+        offset = f.tell()
+        pad = ((offset + 15) & ~15) - offset
+        if pad == 0:
+            pad = 16
+        f.write(b'\x00' * pad)
+        f.write(pack('<I', _FBX_VERSION))
+        f.write(b'\x00' * 120)
+        f.write(_FOOT_MAGIC)
+
+    # objects
+
+    def write_objects(self):
+        with self.w.node("Objects"):
+            for obj in self.objs:
+                if obj.type == 'ARMATURE':
+                    self.write_armature(obj)
+            for obj in self.objs:
+                if obj.type == 'MESH':
+                    self.write_mesh_object(obj)
+            if len(self.objs) != 0:
+                self.write_bind_pose()
+
+    def object_uid(self, obj: Object) -> int:
+        return self.uid(f"Object|{obj.name}")
+
+    def bone_uid(self, armature: Object, bone_name: str) -> int:
+        return self.uid(f"Bone|{armature.name}|{bone_name}")
+
+    def parent_of(self, obj: Object) -> Tuple[int, Matrix]:
+        """uid and world matrix in fbx space of parent model"""
+        if obj.parent is not None and obj.parent.name in self.object_set:
+            return self.object_uid(obj.parent), self.fbx_space(obj.parent.matrix_world)
+        return 0, Matrix.Identity(4)
+
+    def write_model(self, uid: int, name: str, model_type: str, local: Matrix):
+        w = self.w
+        location, rotation, scale = local.decompose()
+        euler = rotation.to_euler('XYZ')
+        with w.node("Model", _int64(uid), _name(name, "Model"), _string(model_type)):
+            w.leaf("Version", _int32(232))
+            with w.node("Properties70"):
+                w.p("Lcl Translation", "Lcl Translation", "", "A", *map(_float64, location))
+                w.p("Lcl Rotation", "Lcl Rotation", "", "A", *(_float64(math.degrees(a)) for a in euler))
+                w.p("Lcl Scaling", "Lcl Scaling", "", "A", *map(_float64, scale))
+                w.p("DefaultAttributeIndex", "int", "Integer", "", _int32(0))
+                w.p("InheritType", "enum", "", "", _int32(1))
+            w.leaf("Shading", _bool(True))
+            w.leaf("Culling", _string("CullingOff"))
+
+    def write_node_attribute(self, uid: int, name: str, attribute_type: str, type_flags: str,
+                             size: Optional[float] = None):
+        w = self.w
+        with w.node("NodeAttribute", _int64(uid), _name(name, "NodeAttribute"), _string(attribute_type)):
+            if size is not None:
+                with w.node("Properties70"):
+                    w.p("Size", "double", "Number", "", _float64(size))
+            w.leaf("TypeFlags", _string(type_flags))
+
+    def write_armature(self, obj: Object):
+        armature = cast(Armature, obj.data)
+        uid = self.object_uid(obj)
+        parent_uid, parent_world = self.parent_of(obj)
+        world = self.fbx_space(obj.matrix_world)
+        self.write_model(uid, obj.name, "Null", parent_world.inverted_safe() @ world)
+        attribute_uid = self.uid(f"NodeAttribute|{obj.name}")
+        self.write_node_attribute(attribute_uid, obj.name, "Null", "Null")
+        self.connections.append((attribute_uid, uid))
+        self.connections.append((uid, parent_uid))
+        self.bind_poses.append((uid, world))
+
+        pose_bones = cast(Dict[str, PoseBone], obj.pose.bones)
+        for bone in cast(List[Bone], armature.bones):
+            bone_uid = self.bone_uid(obj, bone.name)
+            pose_bone = pose_bones[bone.name]
+            if bone.parent is not None:
+                local = pose_bones[bone.parent.name].matrix.inverted_safe() @ pose_bone.matrix
+                parent_uid = self.bone_uid(obj, bone.parent.name)
+            else:
+                local = pose_bone.matrix
+                parent_uid = uid
+            self.write_model(bone_uid, bone.name, "LimbNode", self.fbx_space(local))
+            bone_attribute_uid = self.uid(f"NodeAttribute|{obj.name}|{bone.name}")
+            self.write_node_attribute(bone_attribute_uid, bone.name, "LimbNode", "Skeleton", bone.length)
+            self.connections.append((bone_attribute_uid, bone_uid))
+            self.connections.append((bone_uid, parent_uid))
+            self.bind_poses.append((bone_uid, self.fbx_space(obj.matrix_world @ bone.matrix_local)))
+
+    def write_mesh_object(self, obj: Object):
+        mesh = cast(Mesh, obj.data)
+        uid = self.object_uid(obj)
+        parent_uid, parent_world = self.parent_of(obj)
+        world = self.fbx_space(obj.matrix_world)
+        self.write_model(uid, obj.name, "Mesh", parent_world.inverted_safe() @ world)
+        self.connections.append((uid, parent_uid))
+        self.bind_poses.append((uid, world))
+
+        geometry_uid = self.uid(f"Geometry|{obj.name}|{mesh.name}")
+        self.write_geometry(obj, mesh, geometry_uid)
+        self.connections.append((geometry_uid, uid))
+
+        for material in self.materials_of(obj):
+            material_uid = self.uid(f"Material|{material.name}")
+            if material_uid not in self.written_materials:
+                self.written_materials.add(material_uid)
+                self.write_material(material, material_uid)
+            self.connections.append((material_uid, uid))
+
+        self.write_skin(obj, mesh, geometry_uid, world)
+        self.write_blend_shapes(obj, mesh, geometry_uid)
+
+    @staticmethod
+    def materials_of(obj: Object) -> List[Material]:
+        materials: List[Material] = []
+        for slot in obj.material_slots:
+            if slot.material is not None and slot.material not in materials:
+                materials.append(slot.material)
+        return materials
+
+    def write_geometry(self, obj: Object, mesh: Mesh, uid: int):
+        w = self.w
+        rotation = self.space_rotation
+
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3) @ rotation.T
+
+        loop_starts, loop_totals = read_polygon_loops(mesh)
+        loop_order = polygon_loop_indices(loop_starts, loop_totals)
+        polygon_vertices = read_loop_vertices(mesh)[loop_order]
+        # last vertex of each polygon is written as bit inverted value
+        last_loops = np.cumsum(loop_totals) - 1
+        polygon_vertices[last_loops] = ~polygon_vertices[last_loops]
+
+        mesh.calc_normals_split()
+        normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+        mesh.loops.foreach_get("normal", normals)
+        normals = normals.reshape(-1, 3)[loop_order] @ rotation.T
+
+        materials = self.materials_of(obj)
+        slot_to_material = np.array(
+            [materials.index(s.material) if s.material is not None else 0 for s in obj.material_slots] or [0],
+            dtype=np.int32)
+        material_indices = read_material_indices(mesh)
+        material_indices = slot_to_material[np.clip(material_indices, 0, len(slot_to_material) - 1)]
+
+        with w.node("Geometry", _int64(uid), _name(mesh.name, "Geometry"), _string("Mesh")):
+            w.leaf("Properties70")
+            w.leaf("GeometryVersion", _int32(124))
+            w.leaf("Vertices", _float64_array(co))
+            del co
+            w.leaf("PolygonVertexIndex", _int32_array(polygon_vertices))
+            del polygon_vertices
+
+            with w.node("LayerElementNormal", _int32(0)):
+                w.leaf("Version", _int32(101))
+                w.leaf("Name", _string(""))
+                w.leaf("MappingInformationType", _string("ByPolygonVertex"))
+                w.leaf("ReferenceInformationType", _string("Direct"))
+                w.leaf("Normals", _float64_array(normals))
+            del normals
+
+            uv_layer_names: List[str] = []
+            for index, uv_layer in enumerate(mesh.uv_layers):
+                uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+                uv_layer.data.foreach_get("uv", uvs)
+                unique_uvs, uv_indices = np.unique(uvs.reshape(-1, 2)[loop_order], axis=0, return_inverse=True)
+                with w.node("LayerElementUV", _int32(index)):
+                    w.leaf("Version", _int32(101))
+                    w.leaf("Name", _string(uv_layer.name))
+                    w.leaf("MappingInformationType", _string("ByPolygonVertex"))
+                    w.leaf("ReferenceInformationType", _string("IndexToDirect"))
+                    w.leaf("UV", _float64_array(unique_uvs))
+                    w.leaf("UVIndex", _int32_array(uv_indices))
+                uv_layer_names.append(uv_layer.name)
+
+            with w.node("LayerElementMaterial", _int32(0)):
+                w.leaf("Version", _int32(101))
+                w.leaf("Name", _string(""))
+                all_same = len(material_indices) == 0 or np.all(material_indices == material_indices[0])
+                w.leaf("MappingInformationType", _string("AllSame" if all_same else "ByPolygon"))
+                w.leaf("ReferenceInformationType", _string("IndexToDirect"))
+                w.leaf("Materials", _int32_array(material_indices[:1] if all_same else material_indices))
+
+            with w.node("Layer", _int32(0)):
+                w.leaf("Version", _int32(100))
+                for element_type in ("LayerElementNormal", "LayerElementMaterial"):
+                    with w.node("LayerElement"):
+                        w.leaf("Type", _string(element_type))
+                        w.leaf("TypedIndex", _int32(0))
+                if len(uv_layer_names) != 0:
+                    with w.node("LayerElement"):
+                        w.leaf("Type", _string("LayerElementUV"))
+                        w.leaf("TypedIndex", _int32(0))
+            for index in range(1, len(uv_layer_names)):
+                with w.node("Layer", _int32(index)):
+                    w.leaf("Version", _int32(100))
+                    with w.node("LayerElement"):
+                        w.leaf("Type", _string("LayerElementUV"))
+                        w.leaf("TypedIndex", _int32(index))
+
+    def write_material(self, material: Material, uid: int):
+        w = self.w
+        color = material.diffuse_color
+        with w.node("Material", _int64(uid), _name(material.name, "Material"), _string("")):
+            w.leaf("Version", _int32(102))
+            w.leaf("ShadingModel", _string("Phong"))
+            w.leaf("MultiLayer", _int32(0))
+            with w.node("Properties70"):
+                w.p("DiffuseColor", "Color", "", "A", _float64(color[0]), _float64(color[1]), _float64(color[2]))
+                w.p("DiffuseFactor", "Number", "", "A", _float64(1.0))
+                w.p("Opacity", "double", "Number", "", _float64(color[3]))
+
+    def skin_armature_of(self, obj: Object) -> Optional[Object]:
+        for modifier in obj.modifiers:
+            if modifier.type == 'ARMATURE' and cast(ArmatureModifier, modifier).object is not None:
+                armature_obj = cast(ArmatureModifier, modifier).object
+                return armature_obj if armature_obj.name in self.object_set else None
+        return None
+
+    @staticmethod
+    def cluster_groups_of(obj: Object, bones: Dict[str, Bone]) -> List[VertexGroup]:
+        return [g for g in cast(List[VertexGroup], obj.vertex_groups) if g.name in bones]
+
+    def write_skin(self, obj: Object, mesh: Mesh, geometry_uid: int, mesh_world: Matrix):
+        armature_obj = self.skin_armature_of(obj)
+        if armature_obj is None:
+            return
+
+        w = self.w
+        bones = cast(Dict[str, Bone], cast(Armature, armature_obj.data).bones)
+        weights = read_vertex_weights(mesh)
+        skin_uid = self.uid(f"Skin|{obj.name}")
+        with w.node("Deformer", _int64(skin_uid), _name(obj.name, "Deformer"), _string("Skin")):
+            w.leaf("Version", _int32(101))
+            w.leaf("Link_DeformAcuracy", _float64(50.0))
+        self.connections.append((skin_uid, geometry_uid))
+
+        empty = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+        for group in self.cluster_groups_of(obj, bones):
+            bone = bones[group.name]
+            indices, values = weights.get(group.index, empty)
+            bone_world = self.fbx_space(armature_obj.matrix_world @ bone.matrix_local)
+            cluster_uid = self.uid(f"Cluster|{obj.name}|{bone.name}")
+            with w.node("Deformer", _int64(cluster_uid), _name(bone.name, "SubDeformer"), _string("Cluster")):
+                w.leaf("Version", _int32(100))
+                w.leaf("UserData", _string(""), _string(""))
+                w.leaf("Indexes", _int32_array(indices))
+                w.leaf("Weights", _float64_array(values))
+                w.leaf("Transform", _float64_array(_matrix_array(bone_world.inverted_safe() @ mesh_world)))
+                w.leaf("TransformLink", _float64_array(_matrix_array(bone_world)))
+                w.leaf("TransformAssociateModel",
+                       _float64_array(_matrix_array(self.fbx_space(armature_obj.matrix_world))))
+            self.connections.append((cluster_uid, skin_uid))
+            self.connections.append((self.bone_uid(armature_obj, bone.name), cluster_uid))
+
+    def write_blend_shapes(self, obj: Object, mesh: Mesh, geometry_uid: int):
+        if mesh.shape_keys is None or len(mesh.shape_keys.key_blocks) <= 1:
+            return
+        w = self.w
+        rotation = self.space_rotation
+        key_blocks = cast(List[ShapeKey], mesh.shape_keys.key_blocks)
+
+        blend_shape_uid = self.uid(f"BlendShape|{obj.name}")
+        with w.node("Deformer", _int64(blend_shape_uid), _name(mesh.name, "Deformer"), _string("BlendShape")):
+            w.leaf("Version", _int32(100))
+        self.connections.append((blend_shape_uid, geometry_uid))
+
+        for key in key_blocks[1:]:
+            co = np.empty(len(key.data) * 3, dtype=np.float32)
+            relative = np.empty(len(key.data) * 3, dtype=np.float32)
+            key.data.foreach_get("co", co)
+            key.relative_key.data.foreach_get("co", relative)
+            offsets = (co.reshape(-1, 3).astype(np.float64) - relative.reshape(-1, 3)) @ rotation.T
+            del co, relative
+            indices = np.flatnonzero(np.any(offsets != 0, axis=1))
+            offsets = offsets[indices]
+
+            shape_uid = self.uid(f"Shape|{obj.name}|{key.name}")
+            channel_uid = self.uid(f"BlendShapeChannel|{obj.name}|{key.name}")
+            with w.node("Geometry", _int64(shape_uid), _name(key.name, "Geometry"), _string("Shape")):
+                w.leaf("Version", _int32(100))
+                w.leaf("Indexes", _int32_array(indices))
+                w.leaf("Vertices", _float64_array(offsets))
+                w.leaf("Normals", _float64_array(np.zeros_like(offsets)))
+            with w.node("Deformer", _int64(channel_uid), _name(key.name, "SubDeformer"),
+                        _string("BlendShapeChannel")):
+                w.leaf("Version", _int32(100))
+                w.leaf("DeformPercent", _float64(key.value * 100.0))
+                w.leaf("FullWeights", _float64_array([100.0]))
+            self.connections.append((channel_uid, blend_shape_uid))
+            self.connections.append((shape_uid, channel_uid))
+
+    def write_bind_pose(self):
+        w = self.w
+        uid = self.uid("BindPose")
+        with w.node("Pose", _int64(uid), _name("BindPose", "Pose"), _string("BindPose")):
+            w.leaf("Type", _string("BindPose"))
+            w.leaf("Version", _int32(100))
+            w.leaf("NbPoseNodes", _int32(len(self.bind_poses)))
+            for node_uid, matrix in self.bind_poses:
+                with w.node("PoseNode"):
+                    w.leaf("Node", _int64(node_uid))
+                    w.leaf("Matrix", _float64_array(_matrix_array(matrix)))
+
+
+def _matrix_array(matrix: Matrix) -> np.ndarray:
+    # fbx matrices are column major
+    return np.array(matrix, dtype=np.float64).T.ravel()
@@ -1,70 +1,97 @@
+import time
 import typing
 from typing import List, cast, Dict
-from bpy.types import Object, Collection, CollectionObjects, Mesh
-from .utils import select_objects, delete_objects, link_to_collection
+from bpy.types import Object, Mesh, ShapeKey, Modifier
+from .mesh_arrays import invalidate
+from .operator_context import OperatorContext
+from .utils import ModifyAndRollback
 import bpy
+import numpy as np
 
 
-def freeze_modifiers(obj: Object, modifiers: typing.Iterable[str]):
+def freeze_modifiers(obj: Object, modifiers: typing.Iterable[str]) -> Dict[str, float]:
+    """
+        apply modifiers to obj, including its shape keys.
+        returns time in seconds took to evaluate each shape key.
+    """
+    modifiers = list(modifiers)
     if obj.data.shape_keys is None:
         _do_freeze_modifiers(obj, modifiers)
+        return {}
     else:
-        result = _clone(obj)
-        _clear_shape_keys(result, 'Basis')
-        _do_freeze_modifiers(result, modifiers)
-
-        for i in range(1, len(obj.data.shape_keys.key_blocks)):
-            shape_name = obj.data.shape_keys.key_blocks[i].name
-            obj_tmp = _clone(obj)
-
-            _clear_shape_keys(obj_tmp, shape_name)
-
-            _do_freeze_modifiers(obj_tmp, modifiers)
-
-            select_objects([result, obj_tmp])
-
-            bpy.ops.object.join_shapes()
-            result.data.shape_keys.key_blocks[-1].name = shape_name
-
-            delete_objects([obj_tmp])
-
-        tmp_name = obj.name
-        tmp_data_name = obj.data.name
-        result.name = tmp_name + '.tmp'
-
-        obj.data = result.data
-        obj.data.name = tmp_data_name
-
-        for x in modifiers:
-            obj.modifiers.remove(obj.modifiers[x])
-
-        delete_objects([result])
-        pass
+        return _freeze_modifiers_with_shape_keys(obj, modifiers)
+
+
+def _freeze_modifiers_with_shape_keys(obj: Object, modifiers: List[str]) -> Dict[str, float]:
+    mesh = cast(Mesh, obj.data)
+    key_blocks = cast(List[ShapeKey], mesh.shape_keys.key_blocks)
+    timings: Dict[str, float] = {}
+    shape_coordinates: List[np.ndarray] = []
+
+    with ModifyAndRollback() as modify:
+        # evaluate only modifiers to be frozen, with only one shape key each time
+        for modifier in cast(List[Modifier], obj.modifiers):
+            modify.add_modify(modifier, "show_viewport", modifier.name in modifiers)
+        modify.add_modify(obj, "show_only_shape_key", True)
+        modify.add_modify(obj, "active_shape_key_index", 0)
+
+        start = time.perf_counter()
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        result = bpy.data.meshes.new_from_object(
+            obj.evaluated_get(depsgraph),
+            preserve_all_data_layers=True,
+            depsgraph=depsgraph,
+        )
+        timings[key_blocks[0].name] = time.perf_counter() - start
+
+        for i in range(1, len(key_blocks)):
+            start = time.perf_counter()
+            obj.active_shape_key_index = i
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            evaluated = obj.evaluated_get(depsgraph)
+            evaluated_mesh = evaluated.to_mesh()
+            if len(evaluated_mesh.vertices) != len(result.vertices):
+                evaluated.to_mesh_clear()
+                bpy.data.meshes.remove(result)
+                raise Exception(f"vertex count of shape key {key_blocks[i].name} mismatch: "
+                                f"basis: {len(result.vertices)}, key: {len(evaluated_mesh.vertices)}")
+            co = np.empty(len(evaluated_mesh.vertices) * 3, dtype=np.float32)
+            evaluated_mesh.vertices.foreach_get("co", co)
+            evaluated.to_mesh_clear()
+            shape_coordinates.append(co)
+            timings[key_blocks[i].name] = time.perf_counter() - start
+
+    mesh_name = mesh.name
+    obj.data = result
+    for x in modifiers:
+        obj.modifiers.remove(obj.modifiers[x])
+
+    obj.shape_key_add(name=key_blocks[0].name, from_mix=False)
+    for i, co in enumerate(shape_coordinates, start=1):
+        new_key = obj.shape_key_add(name=key_blocks[i].name, from_mix=False)
+        new_key.data.foreach_set("co", co)
+    _copy_shape_key_settings(key_blocks, cast(List[ShapeKey], result.shape_keys.key_blocks))
+
+    if mesh.users == 0:
+        invalidate(mesh)
+        bpy.data.meshes.remove(mesh)
+    result.name = mesh_name
+    return timings
+
+
+def _copy_shape_key_settings(src: List[ShapeKey], dst: List[ShapeKey]):
+    for src_key, dst_key in zip(src, dst):
+        dst_key.interpolation = src_key.interpolation
+        dst_key.mute = src_key.mute
+        dst_key.slider_min = src_key.slider_min
+        dst_key.slider_max = src_key.slider_max
+        dst_key.value = src_key.value
+        dst_key.vertex_group = src_key.vertex_group
+        dst_key.relative_key = cast(Dict[str, ShapeKey], dst)[src_key.relative_key.name]
 
 
 def _do_freeze_modifiers(obj: Object, modifiers: typing.Iterable[str]):
-    select_objects([obj])
-    for m in modifiers:
-        bpy.ops.object.modifier_apply(modifier=m)
-
-
-def _clear_shape_keys(obj: Object, keep: str):
-    select_objects([obj])
-    if obj.data.shape_keys is None:
-        return True
-
-    obj.active_shape_key_index = len(obj.data.shape_keys.key_blocks) - 1
-    while len(obj.data.shape_keys.key_blocks) > 1:
-        if obj.data.shape_keys.key_blocks[obj.active_shape_key_index].name == keep:
-            obj.active_shape_key_index = 0
-        else:
-            bpy.ops.object.shape_key_remove()
-
-    bpy.ops.object.shape_key_remove()
-
-
-def _clone(obj):
-    tmp_obj = obj.copy()
-    tmp_obj.data = tmp_obj.data.copy()
-    obj.users_collection[0].objects.link(tmp_obj)
-    return tmp_obj
+    with OperatorContext([obj]) as context:
+        context.mode_set('OBJECT')
+        for m in modifiers:
+            context.call(bpy.ops.object.modifier_apply, modifier=m)
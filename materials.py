@@ -1,45 +1,66 @@
 import typing
-from typing import Dict, cast, List, Optional
+from typing import Dict, cast, Iterable, List, Optional, Set, Union
 
 import bpy
-from bpy.types import Object, Mesh, MeshPolygon, Material, IDMaterials, BlendDataMaterials, MeshUVLoop, UVLoopLayers
+import numpy as np
+from bpy.types import Object, Mesh, Material, IDMaterials, BlendDataMaterials
 
-from .utils import UVRegion, select_objects
+from .mesh_arrays import MeshArrays, invalidate
+from .utils import UVLayers, UVRegion, as_list, delete_faces, polygon_loop_indices, uv_layer_names
 
 
 def remove_face_of_materials(
-        obj: Object,
-        remove_mat: str,
-):
-    mesh = obj.data
-    if not isinstance(mesh, Mesh):
-        raise Exception("object is not mesh")
-
-    mat_index: Optional[int] = None
-
-    for index, material in enumerate(cast(List[Material], mesh.materials)):
-        if remove_mat == material.name:
-            mat_index = index
-
-    if mat_index is None:
-        raise Exception(f"material named {remove_mat} not found")
-
-    for poly in cast(List[MeshPolygon], mesh.polygons):
-        if poly.material_index != mat_index:
+        obj: Union[Object, Iterable[Object]],
+        remove_mat: Union[str, Iterable[str]],
+) -> Dict[str, int]:
+    """
+        remove faces of materials and the material slots.
+        returns count of removed faces for each object.
+    """
+    objs = as_list(obj, Object)
+    remove_mats = as_list(remove_mat, str)
+    found_mats: Set[str] = set()
+    removed: Dict[str, int] = {}
+
+    mat_indices_of: List[List[int]] = []
+    for o in objs:
+        mesh = o.data
+        if not isinstance(mesh, Mesh):
+            raise Exception("object is not mesh")
+
+        mat_indices: List[int] = []
+        for index, material in enumerate(cast(List[Material], mesh.materials)):
+            if material is not None and material.name in remove_mats:
+                mat_indices.append(index)
+                found_mats.add(material.name)
+        mat_indices_of.append(mat_indices)
+
+    for mat_name in remove_mats:
+        if mat_name not in found_mats:
+            raise Exception(f"material named {mat_name} not found")
+
+    done_meshes: Set[int] = set()
+    for o, mat_indices in zip(objs, mat_indices_of):
+        mesh = cast(Mesh, o.data)
+        # indices of shared mesh are computed before the first object removes faces
+        if mesh.as_pointer() in done_meshes:
+            removed[o.name] = 0
             continue
-        poly.select = True
-        pass
+        done_meshes.add(mesh.as_pointer())
+        removed[o.name] = delete_faces(mesh, np.isin(MeshArrays.of(mesh).material_indices, mat_indices))
 
-    bpy.ops.object.mode_set_with_submode(mode='EDIT', mesh_select_mode={'FACE'})
-    bpy.ops.mesh.delete(type='FACE')
-    bpy.ops.object.mode_set(mode='OBJECT')
-    remove_material(mesh, remove_mat)
+        # material indices of remaining faces are shifted by pop
+        for index in reversed(mat_indices):
+            cast(IDMaterials, mesh.materials).pop(index=index)
+        invalidate(mesh)
+    return removed
 
 
 def merge_materials(
         obj: Object,
         region_mapping: Dict[str, UVRegion],
         final_material: str,
+        uv_layers: UVLayers = None,  # None for the active layer, "all" or names of layers
 ):
     mesh = obj.data
     if not isinstance(mesh, Mesh):
@@ -62,17 +83,29 @@ def merge_materials(
         cast(IDMaterials, mesh.materials).append(found_mat)
         final_material_index = len(cast(List[Material], mesh.materials)) - 1
 
-    uv_loops = cast(List[MeshUVLoop], cast(UVLoopLayers, mesh.uv_layers).active.data)  # TODO: selectable by param
+    arrays = MeshArrays.of(mesh)
+    material_indices = arrays.material_indices
+    loop_starts = arrays.loop_starts
+    loop_totals = arrays.loop_totals
 
-    for poly in cast(List[MeshPolygon], mesh.polygons):
-        region = region_mapping_by_index.get(poly.material_index)
-        if region is None:
-            continue
-        for loop_idx in cast(range, poly.loop_indices):
-            loop = uv_loops[loop_idx]
-            loop.uv = [*region.fit_from_1x1(*loop.uv)]
-        poly.material_index = final_material_index
-        pass
+    table_size = max(len(cast(List[Material], mesh.materials)), int(material_indices.max(initial=-1)) + 1)
+    affected = np.zeros(table_size, dtype=bool)
+    affected[[*region_mapping_by_index]] = True
+
+    affected_polygons = affected[material_indices]
+    loop_indices = polygon_loop_indices(loop_starts[affected_polygons], loop_totals[affected_polygons])
+    loop_materials = np.repeat(material_indices[affected_polygons], loop_totals[affected_polygons])
+    loops_of_material = {index: loop_indices[loop_materials == index] for index in region_mapping_by_index}
+
+    for uv_layer in uv_layer_names(mesh, uv_layers):
+        uvs = arrays.uv(uv_layer)
+        for index, region in region_mapping_by_index.items():
+            loops = loops_of_material[index]
+            uvs[loops] = region.fit_from_1x1_batch(uvs[loops])
+        arrays.write_uv(uv_layer)
+
+    material_indices[affected_polygons] = final_material_index
+    arrays.write_material_indices()
 
     for mat_name in region_mapping.keys():
         remove_material(mesh, mat_name)
@@ -83,28 +116,88 @@ def remove_material(mesh: Mesh, name: str):
     for index, mat in enumerate(cast(typing.Iterable[Material], mats)):
         if mat.name == name:
             mats.pop(index = index)
+            invalidate(mesh)
             return
 
 
-def simple_merge_materials(obj: Object, merge_from: List[str], merge_to: str):
-    select_objects([obj])
-    bpy.ops.object.mode_set(mode='EDIT')
+def remap_materials(
+        obj: Union[Object, Iterable[Object]],
+        mapping: Dict[str, str],
+        compact: bool = True,
+) -> Dict[str, int]:
+    """
+        replace materials of faces with mapping from material name to material name.
+        if compact, material slots no face uses are removed.
+        returns count of remapped faces for each object.
+    """
+    objs = as_list(obj, Object)
+    for to_name in set(mapping.values()):
+        if cast(Dict[str, Material], bpy.data.materials).get(to_name) is None:
+            raise Exception(f"material named {to_name} not found")
+
+    remapped: Dict[str, int] = {}
+    done_meshes: Set[int] = set()
+    for o in objs:
+        mesh = o.data
+        if not isinstance(mesh, Mesh):
+            raise Exception("object is not mesh")
+        if mesh.as_pointer() in done_meshes:
+            remapped[o.name] = 0
+            continue
+        done_meshes.add(mesh.as_pointer())
 
-    bpy.ops.mesh.select_all(action='DESELECT')
-    bpy.ops.mesh.select_mode(use_extend=False, use_expand=False, type='FACE')
+        materials = cast(List[Optional[Material]], [*mesh.materials])
+        if len(materials) == 0:
+            remapped[o.name] = 0
+            continue
+        names = [m.name if m is not None else None for m in materials]
+        changed = np.array([name in mapping for name in names], dtype=bool)
+        target_names = [mapping[name] if name in mapping else name for name in names]
+
+        arrays = MeshArrays.of(mesh)
+        material_indices = np.clip(arrays.material_indices, 0, len(materials) - 1)
+        remapped[o.name] = int(np.count_nonzero(changed[material_indices]))
+
+        new_materials: List[Optional[Material]] = []
+        new_index: Dict[Optional[str], int] = {}
+        if compact:
+            used = np.zeros(len(materials), dtype=bool)
+            used[material_indices] = True
+            for name, is_used in zip(target_names, used):
+                if is_used and name not in new_index:
+                    new_index[name] = len(new_materials)
+                    new_materials.append(_material_or_none(name))
+            lut = np.array([new_index.get(name, 0) for name in target_names], dtype=np.int32)
+        else:
+            new_materials = [*materials]
+            for index, name in enumerate(names):
+                new_index.setdefault(name, index)
+            for name in target_names:
+                if name not in new_index:
+                    new_index[name] = len(new_materials)
+                    new_materials.append(_material_or_none(name))
+            lut = np.array([new_index[target] if is_changed else index
+                            for index, (target, is_changed) in enumerate(zip(target_names, changed))], dtype=np.int32)
+
+        if len(new_materials) == len(materials) and np.array_equal(lut, np.arange(len(materials))):
+            continue
 
-    from_indices = [obj.material_slots[mat_name].slot_index for mat_name in merge_from]
-    to_index = obj.material_slots[merge_to].slot_index
+        mats = cast(IDMaterials, mesh.materials)
+        mats.clear()
+        for material in new_materials:
+            mats.append(material)
+        arrays.material_indices[:] = lut[material_indices]
+        arrays.write_material_indices()
+    return remapped
 
-    for mat_indices in from_indices:
-        bpy.context.object.active_material_index = mat_indices
-        bpy.ops.object.material_slot_select()
 
-    bpy.context.object.active_material_index = to_index
-    bpy.ops.object.material_slot_assign()
+def _material_or_none(name: Optional[str]) -> Optional[Material]:
+    return cast(Dict[str, Material], bpy.data.materials)[name] if name is not None else None
 
-    bpy.ops.object.mode_set(mode='OBJECT')
 
-    for mat_indices in from_indices:
-        bpy.context.object.active_material_index = mat_indices
-        bpy.ops.object.material_slot_select()
+def simple_merge_materials(obj: Object, merge_from: List[str], merge_to: str):
+    """assign merge_to to faces of merge_from. material slots are kept"""
+    for name in [*merge_from, merge_to]:
+        if name not in obj.material_slots:
+            raise KeyError(name)
+    remap_materials(obj, {name: merge_to for name in merge_from}, compact=False)
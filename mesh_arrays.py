@@ -0,0 +1,186 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# array snapshot of meshes shared by mesh operations of the library.
+# each array is read with one foreach_get on first access.
+# snapshots are shared only inside "with MeshArrays.sharing():" and dropped at the end of it,
+# outside of it each MeshArrays.of call reads the mesh again.
+# while sharing, the snapshot is also dropped when counts of elements or layers of the mesh changes,
+# when the depsgraph reports an update of the mesh, or when invalidate is called.
+# functions of this library writing to meshes keep snapshots in sync, but edits to meshes in other ways
+# inside the sharing block must be followed by invalidate or they're overwritten with the snapshot.
+
+import contextlib
+from typing import Dict, Iterator, List, Optional, Tuple, cast
+
+import bpy
+import numpy as np
+from bpy.types import Depsgraph, DepsgraphUpdate, Mesh, MeshUVLoopLayer, Object, Scene
+
+from .utils import read_loop_vertices, read_material_indices, read_polygon_loops, read_vertex_weights
+
+_cache: Dict[int, 'MeshArrays'] = {}
+# depth of nested sharing blocks
+_sharing = 0
+
+
+class MeshArrays:
+    """bulk-read arrays of a mesh. use MeshArrays.of(mesh) to share the snapshot"""
+
+    __slots__ = ("mesh", "_state", "_co", "_loop_starts", "_loop_totals", "_loop_vertices", "_material_indices",
+                 "_uvs", "_weights")
+
+    def __init__(self, mesh: Mesh):
+        self.mesh: Mesh = mesh
+        self._state: Tuple = _state_of(mesh)
+        self._co: Optional[np.ndarray] = None
+        self._loop_starts: Optional[np.ndarray] = None
+        self._loop_totals: Optional[np.ndarray] = None
+        self._loop_vertices: Optional[np.ndarray] = None
+        self._material_indices: Optional[np.ndarray] = None
+        self._uvs: Dict[str, np.ndarray] = {}
+        self._weights: Optional[Dict[int, Tuple[np.ndarray, np.ndarray]]] = None
+
+    @staticmethod
+    def of(mesh: Mesh) -> 'MeshArrays':
+        """the shared snapshot of mesh if in sharing block and mesh seems not to be changed, or new one"""
+        if _sharing == 0:
+            return MeshArrays(mesh)
+        _register_handler()
+        arrays = _cache.get(mesh.as_pointer())
+        if arrays is None or arrays._state != _state_of(mesh):
+            arrays = MeshArrays(mesh)
+            _cache[mesh.as_pointer()] = arrays
+        return arrays
+
+    @staticmethod
+    @contextlib.contextmanager
+    def sharing() -> Iterator[None]:
+        """share snapshots between operations in the block"""
+        global _sharing
+        _sharing += 1
+        try:
+            yield
+        finally:
+            _sharing -= 1
+            if _sharing == 0:
+                _cache.clear()
+
+    @property
+    def co(self) -> np.ndarray:
+        """(vertices, 3) float32 coordinates"""
+        if self._co is None:
+            co = np.empty(len(self.mesh.vertices) * 3, dtype=np.float32)
+            self.mesh.vertices.foreach_get("co", co)
+            self._co = co.reshape(-1, 3)
+        return self._co
+
+    @property
+    def loop_starts(self) -> np.ndarray:
+        if self._loop_starts is None:
+            self._loop_starts, self._loop_totals = read_polygon_loops(self.mesh)
+        return self._loop_starts
+
+    @property
+    def loop_totals(self) -> np.ndarray:
+        if self._loop_totals is None:
+            self._loop_starts, self._loop_totals = read_polygon_loops(self.mesh)
+        return self._loop_totals
+
+    @property
+    def loop_vertices(self) -> np.ndarray:
+        if self._loop_vertices is None:
+            self._loop_vertices = read_loop_vertices(self.mesh)
+        return self._loop_vertices
+
+    @property
+    def material_indices(self) -> np.ndarray:
+        if self._material_indices is None:
+            self._material_indices = read_material_indices(self.mesh)
+        return self._material_indices
+
+    @property
+    def weights(self) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """vertex group index to vertex indices and weights"""
+        if self._weights is None:
+            self._weights = read_vertex_weights(self.mesh)
+        return self._weights
+
+    def uv(self, name: Optional[str] = None) -> np.ndarray:
+        """(loops, 2) float32 uv of the layer, or the active layer if name is None"""
+        layer = self._uv_layer(name)
+        uv = self._uvs.get(layer.name)
+        if uv is None:
+            uv = np.empty(len(layer.data) * 2, dtype=np.float32)
+            layer.data.foreach_get("uv", uv)
+            uv = uv.reshape(-1, 2)
+            self._uvs[layer.name] = uv
+        return uv
+
+    def vertices_in_group(self, group_index: int) -> np.ndarray:
+        """bool array, True for vertices assigned to the vertex group"""
+        mask = np.zeros(len(self.mesh.vertices), dtype=bool)
+        if group_index in self.weights:
+            mask[self.weights[group_index][0]] = True
+        return mask
+
+    def write_co(self):
+        self.mesh.vertices.foreach_set("co", self.co.ravel())
+        self.mesh.update()
+
+    def write_material_indices(self):
+        self.mesh.polygons.foreach_set("material_index", self.material_indices)
+
+    def write_uv(self, name: Optional[str] = None):
+        layer = self._uv_layer(name)
+        layer.data.foreach_set("uv", self.uv(layer.name).ravel())
+
+    def _uv_layer(self, name: Optional[str]) -> MeshUVLoopLayer:
+        layers = self.mesh.uv_layers
+        layer = layers.active if name is None else cast(Dict[str, MeshUVLoopLayer], layers).get(name)
+        if layer is None:
+            raise Exception(f"uv layer {name if name is not None else '(active)'} not found on {self.mesh.name}")
+        return layer
+
+
+def invalidate(mesh: Mesh):
+    """drop the snapshot of mesh. call this after modifying the mesh not through MeshArrays"""
+    _cache.pop(mesh.as_pointer(), None)
+
+
+def invalidate_all():
+    _cache.clear()
+
+
+def _state_of(mesh: Mesh) -> Tuple:
+    return (mesh.name, mesh.is_editmode, len(mesh.vertices), len(mesh.edges), len(mesh.loops), len(mesh.polygons),
+            tuple(layer.name for layer in cast(List[MeshUVLoopLayer], mesh.uv_layers)))
+
+
+def _on_depsgraph_update(scene: Scene, depsgraph: Depsgraph):
+    if len(_cache) == 0:
+        return
+    for update in cast(List[DepsgraphUpdate], depsgraph.updates):
+        data = update.id.original
+        if isinstance(data, Object):
+            data = data.data
+        if isinstance(data, Mesh) and (update.is_updated_geometry or isinstance(update.id.original, Mesh)):
+            invalidate(data)
+
+
+def _register_handler():
+    handlers = bpy.app.handlers.depsgraph_update_post
+    if _on_depsgraph_update not in handlers:
+        handlers.append(_on_depsgraph_update)
@@ -0,0 +1,284 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# join of mesh objects on arrays.
+# meshes are read with foreach_get, concatenated with numpy and written to a new mesh with foreach_set
+# so no selection, active object nor copied data blocks are needed unlike bpy.ops.object.join.
+
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+import bpy
+import numpy as np
+from bpy.types import Collection, Material, Mesh, MeshUVLoopLayer, MeshLoopColorLayer, Object, ShapeKey, \
+    VertexGroup
+from mathutils import Matrix
+
+from .mesh_arrays import MeshArrays
+from .utils import link_to_collection, write_vertex_weights
+
+
+class MeshParts:
+    """arrays of a mesh read in bulk"""
+
+    def __init__(self):
+        self.co: np.ndarray = np.zeros((0, 3), dtype=np.float32)
+        self.edges: np.ndarray = np.zeros((0, 2), dtype=np.int32)
+        self.edge_seams: np.ndarray = np.zeros(0, dtype=bool)
+        self.edge_sharps: np.ndarray = np.zeros(0, dtype=bool)
+        self.loop_vertices: np.ndarray = np.zeros(0, dtype=np.int32)
+        self.loop_edges: np.ndarray = np.zeros(0, dtype=np.int32)
+        # custom split normals, or None if not read
+        self.loop_normals: Optional[np.ndarray] = None
+        self.loop_starts: np.ndarray = np.zeros(0, dtype=np.int32)
+        self.loop_totals: np.ndarray = np.zeros(0, dtype=np.int32)
+        self.material_indices: np.ndarray = np.zeros(0, dtype=np.int32)
+        self.use_smooth: np.ndarray = np.zeros(0, dtype=bool)
+        # auto smooth angle, or None if auto smooth is disabled
+        self.auto_smooth_angle: Optional[float] = None
+        self.materials: List[Optional[Material]] = []
+        self.uv_layers: Dict[str, np.ndarray] = {}
+        self.active_uv_layer: Optional[str] = None
+        self.color_layers: Dict[str, np.ndarray] = {}
+        self.shape_keys: Dict[str, np.ndarray] = {}
+        self.shape_key_settings: Dict[str, Dict[str, Any]] = {}
+        # vertex group name to vertex indices and weights
+        self.weights: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def transform(self, matrix: Matrix):
+        """transforms coordinates, shape keys and normals with matrix"""
+        m = np.array(matrix, dtype=np.float64)
+        if np.allclose(m, np.identity(4)):
+            return
+        linear = m[:3, :3]
+        offset = m[:3, 3]
+        self.co = (self.co @ linear.T + offset).astype(np.float32)
+        for name, co in self.shape_keys.items():
+            self.shape_keys[name] = (co @ linear.T + offset).astype(np.float32)
+        if self.loop_normals is not None:
+            normals = self.loop_normals @ np.linalg.inv(linear)
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            self.loop_normals = (normals / np.where(lengths == 0, 1, lengths)).astype(np.float32)
+
+
+_SHAPE_KEY_SETTINGS = ("interpolation", "mute", "slider_min", "slider_max", "value", "vertex_group")
+
+
+def read_mesh_parts(obj: Object, read_normals: bool = False) -> MeshParts:
+    """
+        read the mesh of obj in bulk. vertex groups and materials are resolved with obj.
+        if read_normals, split normals are read even if the mesh has no custom normals.
+    """
+    mesh = cast(Mesh, obj.data)
+    arrays = MeshArrays.of(mesh)
+    parts = MeshParts()
+    parts.co = arrays.co
+    parts.edges = _get(mesh.edges, "vertices", np.int32, 2)
+    parts.edge_seams = _get(mesh.edges, "use_seam", bool)
+    parts.edge_sharps = _get(mesh.edges, "use_edge_sharp", bool)
+    parts.loop_vertices = arrays.loop_vertices
+    parts.loop_edges = _get(mesh.loops, "edge_index", np.int32)
+    if read_normals or mesh.has_custom_normals:
+        mesh.calc_normals_split()
+        parts.loop_normals = _get(mesh.loops, "normal", np.float32, 3)
+    parts.loop_starts = arrays.loop_starts
+    parts.loop_totals = arrays.loop_totals
+    parts.material_indices = arrays.material_indices
+    parts.use_smooth = _get(mesh.polygons, "use_smooth", bool)
+    parts.auto_smooth_angle = mesh.auto_smooth_angle if mesh.use_auto_smooth else None
+    parts.materials = [slot.material for slot in obj.material_slots]
+
+    for uv_layer in cast(List[MeshUVLoopLayer], mesh.uv_layers):
+        parts.uv_layers[uv_layer.name] = arrays.uv(uv_layer.name)
+    if mesh.uv_layers.active is not None:
+        parts.active_uv_layer = mesh.uv_layers.active.name
+    for color_layer in cast(List[MeshLoopColorLayer], mesh.vertex_colors):
+        parts.color_layers[color_layer.name] = _get(color_layer.data, "color", np.float32, 4)
+
+    if mesh.shape_keys is not None:
+        for key in cast(List[ShapeKey], mesh.shape_keys.key_blocks):
+            parts.shape_keys[key.name] = _get(key.data, "co", np.float32, 3)
+            settings = {attr: getattr(key, attr) for attr in _SHAPE_KEY_SETTINGS}
+            settings["relative_key"] = key.relative_key.name
+            parts.shape_key_settings[key.name] = settings
+
+    groups = cast(List[VertexGroup], obj.vertex_groups)
+    for group, weights in arrays.weights.items():
+        if group < len(groups):
+            parts.weights[groups[group].name] = weights
+    return parts
+
+
+def concatenate_mesh_parts(parts_list: List[MeshParts]) -> MeshParts:
+    """
+        concatenate meshes into one. materials, uv layers, color layers, shape keys and vertex groups are merged by name.
+        elements missing in some meshes are filled with zero uv, white color and the coordinates of the mesh.
+    """
+    result = MeshParts()
+    vertex_offsets = _offsets([len(p.co) for p in parts_list])
+    edge_offsets = _offsets([len(p.edges) for p in parts_list])
+    loop_offsets = _offsets([len(p.loop_vertices) for p in parts_list])
+
+    material_keys: Dict[Optional[str], int] = {}
+    material_luts: List[np.ndarray] = []
+    for parts in parts_list:
+        materials = parts.materials if len(parts.materials) != 0 else [None]
+        lut = np.empty(len(materials), dtype=np.int32)
+        for i, material in enumerate(materials):
+            key = material.name if material is not None else None
+            if key not in material_keys:
+                material_keys[key] = len(result.materials)
+                result.materials.append(material)
+            lut[i] = material_keys[key]
+        material_luts.append(lut)
+
+    result.co = np.concatenate([p.co for p in parts_list])
+    result.edges = np.concatenate([p.edges + o for p, o in zip(parts_list, vertex_offsets)])
+    result.edge_seams = np.concatenate([p.edge_seams for p in parts_list])
+    result.edge_sharps = np.concatenate([p.edge_sharps for p in parts_list])
+    result.loop_vertices = np.concatenate([p.loop_vertices + o for p, o in zip(parts_list, vertex_offsets)])
+    result.loop_edges = np.concatenate([p.loop_edges + o for p, o in zip(parts_list, edge_offsets)])
+    result.loop_starts = np.concatenate([p.loop_starts + o for p, o in zip(parts_list, loop_offsets)])
+    result.loop_totals = np.concatenate([p.loop_totals for p in parts_list])
+    result.material_indices = np.concatenate([lut[np.clip(p.material_indices, 0, len(lut) - 1)]
+                                              for p, lut in zip(parts_list, material_luts)])
+    result.use_smooth = np.concatenate([p.use_smooth for p in parts_list])
+    result.auto_smooth_angle = next((p.auto_smooth_angle for p in parts_list if p.auto_smooth_angle is not None),
+                                    None)
+    if any(p.loop_normals is not None for p in parts_list):
+        if any(p.loop_normals is None for p in parts_list):
+            raise Exception("split normals must be read from all meshes or none of them")
+        result.loop_normals = np.concatenate([p.loop_normals for p in parts_list])
+
+    for name in _names_in_order([p.uv_layers for p in parts_list]):
+        result.uv_layers[name] = np.concatenate([
+            p.uv_layers[name] if name in p.uv_layers else np.zeros((len(p.loop_vertices), 2), dtype=np.float32)
+            for p in parts_list])
+    result.active_uv_layer = next((p.active_uv_layer for p in parts_list if p.active_uv_layer is not None), None)
+    for name in _names_in_order([p.color_layers for p in parts_list]):
+        result.color_layers[name] = np.concatenate([
+            p.color_layers[name] if name in p.color_layers else np.ones((len(p.loop_vertices), 4), dtype=np.float32)
+            for p in parts_list])
+    for name in _names_in_order([p.shape_keys for p in parts_list]):
+        result.shape_keys[name] = np.concatenate([p.shape_keys.get(name, p.co) for p in parts_list])
+        result.shape_key_settings[name] = next(p.shape_key_settings[name] for p in parts_list if name in p.shape_keys)
+    for name in _names_in_order([p.weights for p in parts_list]):
+        with_group = [(p.weights[name], o) for p, o in zip(parts_list, vertex_offsets) if name in p.weights]
+        result.weights[name] = (np.concatenate([indices + o for (indices, _), o in with_group]),
+                                np.concatenate([weights for (_, weights), _ in with_group]))
+    return result
+
+
+def build_mesh(name: str, parts: MeshParts) -> Mesh:
+    """create a new mesh from parts. shape keys and vertex weights are set with assign_object_data"""
+    mesh = cast(Mesh, bpy.data.meshes.new(name))
+    mesh.vertices.add(len(parts.co))
+    mesh.vertices.foreach_set("co", parts.co.ravel())
+    mesh.edges.add(len(parts.edges))
+    mesh.edges.foreach_set("vertices", parts.edges.ravel())
+    mesh.edges.foreach_set("use_seam", parts.edge_seams)
+    mesh.edges.foreach_set("use_edge_sharp", parts.edge_sharps)
+    mesh.loops.add(len(parts.loop_vertices))
+    mesh.loops.foreach_set("vertex_index", parts.loop_vertices)
+    mesh.loops.foreach_set("edge_index", parts.loop_edges)
+    mesh.polygons.add(len(parts.loop_starts))
+    mesh.polygons.foreach_set("loop_start", parts.loop_starts)
+    mesh.polygons.foreach_set("loop_total", parts.loop_totals)
+    mesh.polygons.foreach_set("material_index", parts.material_indices)
+    mesh.polygons.foreach_set("use_smooth", parts.use_smooth)
+    for material in parts.materials:
+        mesh.materials.append(material)
+
+    for uv_name, uv in parts.uv_layers.items():
+        mesh.uv_layers.new(name=uv_name).data.foreach_set("uv", uv.ravel())
+    if parts.active_uv_layer is not None:
+        mesh.uv_layers.active = mesh.uv_layers[parts.active_uv_layer]
+    for color_name, color in parts.color_layers.items():
+        mesh.vertex_colors.new(name=color_name).data.foreach_set("color", color.ravel())
+
+    mesh.update()
+    if parts.auto_smooth_angle is not None:
+        mesh.use_auto_smooth = True
+        mesh.auto_smooth_angle = parts.auto_smooth_angle
+    if parts.loop_normals is not None:
+        mesh.use_auto_smooth = True
+        mesh.normals_split_custom_set(parts.loop_normals)
+    return mesh
+
+
+def assign_object_data(obj: Object, parts: MeshParts):
+    """add shape keys and vertex weights of parts to obj whose data is built from parts"""
+    for key_name, co in parts.shape_keys.items():
+        key = obj.shape_key_add(name=key_name, from_mix=False)
+        key.data.foreach_set("co", co.ravel())
+    if len(parts.shape_keys) != 0:
+        key_blocks = cast(Dict[str, ShapeKey], cast(Mesh, obj.data).shape_keys.key_blocks)
+        for key_name, settings in parts.shape_key_settings.items():
+            key = key_blocks[key_name]
+            for attr in _SHAPE_KEY_SETTINGS:
+                setattr(key, attr, settings[attr])
+            relative_key = key_blocks.get(settings["relative_key"])
+            if relative_key is not None:
+                key.relative_key = relative_key
+
+    groups = cast(Dict[str, VertexGroup], obj.vertex_groups)
+    for group_name, (indices, weights) in parts.weights.items():
+        group = groups.get(group_name)
+        if group is None:
+            group = obj.vertex_groups.new(name=group_name)
+        write_vertex_weights(group, indices, weights)
+
+
+def copy_join(objs: List[Object], name: str) -> Object:
+    """
+        create a new object joining meshes of objs. source objects are not modified.
+        the new object is a copy of objs[0] and linked to the first collection of objs[0]
+    """
+    base = objs[0]
+    base_inverse = base.matrix_world.inverted()
+    read_normals = any(cast(Mesh, obj.data).has_custom_normals for obj in objs)
+    parts_list: List[MeshParts] = []
+    for obj in objs:
+        parts = read_mesh_parts(obj, read_normals)
+        if obj is not base:
+            parts.transform(base_inverse @ obj.matrix_world)
+        parts_list.append(parts)
+    parts = concatenate_mesh_parts(parts_list)
+
+    result = cast(Object, base.copy())
+    result.data = build_mesh(name, parts)
+    result.name = name
+    for slot in result.material_slots:
+        slot.link = 'DATA'
+    link_to_collection([result], collection=cast(List[Collection], base.users_collection)[0])
+    assign_object_data(result, parts)
+    return result
+
+
+def _get(collection, attr: str, dtype, size: int = 1) -> np.ndarray:
+    array = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, array)
+    return array if size == 1 else array.reshape(-1, size)
+
+
+def _offsets(counts: List[int]) -> List[int]:
+    return [int(o) for o in np.cumsum([0, *counts[:-1]])]
+
+
+def _names_in_order(dicts: List[Dict[str, Any]]) -> List[str]:
+    names: Dict[str, None] = {}
+    for d in dicts:
+        for name in d:
+            names[name] = None
+    return [*names]
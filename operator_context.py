@@ -0,0 +1,62 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+from typing import Any, Callable, List, Optional, Sequence
+
+import bpy
+from bpy.types import Object
+
+
+class OperatorContext:
+    """
+        runs operators against explicit objects with Context.temp_override
+        instead of changing selection and active object of the view layer.
+        mode of the active object is restored when exiting with statement.
+    """
+
+    def __init__(self, objs: Sequence[Object], active: Optional[Object] = None):
+        self.objects: List[Object] = [*objs]
+        self.active: Optional[Object] = active if active is not None else next(iter(self.objects), None)
+        self._entry_mode: Optional[str] = None
+
+    def __enter__(self):
+        if self.active is not None:
+            self._entry_mode = self.active.mode
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._entry_mode is not None:
+            self.mode_set(self._entry_mode)
+        return False
+
+    def override(self):
+        in_edit = self.active is not None and self.active.mode == 'EDIT'
+        return bpy.context.temp_override(
+            object=self.active,
+            active_object=self.active,
+            edit_object=self.active if in_edit else None,
+            selected_objects=self.objects,
+            selected_editable_objects=self.objects,
+        )
+
+    def call(self, operator: Callable[..., Any], *args, **kwargs):
+        with self.override():
+            return operator(*args, **kwargs)
+
+    def mode_set(self, mode: str, **kwargs):
+        # mode switch updates view layer so skip if not needed
+        if self.active is None or self.active.mode == mode:
+            return
+        self.call(bpy.ops.object.mode_set, mode=mode, **kwargs)
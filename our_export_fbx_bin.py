@@ -15,11 +15,54 @@ import io_scene_fbx.fbx_utils
 import hashlib
 from types import SimpleNamespace
 
-_keys_to_uuids = {}
-_uuids_to_keys = {}
+# collision resolution gives up after this count of probes
+_MAX_UUID_PROBES = 1 << 16
 
 
-def _new_fbx_uuid_gen(key, uuids):
+class UUIDRegistryStats:
+    def __init__(self):
+        self.keys: int = 0
+        self.collisions: int = 0
+        self.probes: int = 0
+
+    def __repr__(self):
+        return f"UUIDRegistryStats(keys={self.keys}, collisions={self.collisions}, probes={self.probes})"
+
+
+class _UUIDRegistry:
+    """key <-> uuid registry for one export. this is discarded after each export_fbx call"""
+
+    def __init__(self):
+        self.keys_to_uuids = {}
+        self.uuids_to_keys = {}
+        self.stats = UUIDRegistryStats()
+
+    def fbx_uuid_from_key(self, key):
+        uuid = self.keys_to_uuids.get(key)
+        if uuid is None:
+            uuid = _new_fbx_uuid_gen(key, self.uuids_to_keys, self.stats)
+            self.keys_to_uuids[key] = uuid
+            self.uuids_to_keys[uuid] = key
+            self.stats.keys += 1
+        return uuid
+
+    def fbx_key_from_uuid(self, uuid):
+        """
+        Return the key which generated this uid.
+        """
+        assert(uuid.__class__ == fbx_utils.UUID)
+        return self.uuids_to_keys.get(uuid, None)
+
+
+_last_stats = None
+
+
+def last_export_uuid_stats():
+    """statistics of uuid registry of last export_fbx call"""
+    return _last_stats
+
+
+def _new_fbx_uuid_gen(key, uuids, stats=None):
     if isinstance(key, int) and 0 <= key < 2 ** 63:
         uuid = key
     elif isinstance(key, str):
@@ -37,38 +80,28 @@ def _new_fbx_uuid_gen(key, uuids):
 
     # Make sure our uuid *is* unique.
     if uuid in uuids:
+        if stats is not None:
+            stats.collisions += 1
         inc = 1 if uuid < 2**62 else -1
+        probes = 0
         while uuid in uuids:
             uuid += inc
-            if 0 > uuid >= 2**63:
-                # Note that this is more that unlikely, but does not harm anyway...
+            probes += 1
+            if probes > _MAX_UUID_PROBES or not 0 <= uuid < 2**63:
                 raise ValueError("Unable to generate an UUID for key {}".format(key))
+        if stats is not None:
+            stats.probes += probes
 
     return fbx_utils.UUID(uuid)
 
 
-def _fbx_uuid_from_key(key):
-    uuid = _keys_to_uuids.get(key)
-    if uuid is None:
-        uuid = _new_fbx_uuid_gen(key, _uuids_to_keys)
-        _keys_to_uuids[key] = uuid
-        _uuids_to_keys[uuid] = key
-    return uuid
-
-
-def _fbx_key_from_uuid(uuid):
-    """
-    Return the key which generated this uid.
-    """
-    assert(uuid.__class__ == fbx_utils.UUID)
-    return _uuids_to_keys.get(uuid, None)
-
-
 def export_fbx(*args, **kwargs):
+    global _last_stats
+    registry = _UUIDRegistry()
     with ModifyAndRollback() as modify:
-        modify.add_modify(fbx_utils, "get_key_from_fbx_uuid", _fbx_key_from_uuid)
-        modify.add_modify(fbx_utils, "get_fbx_uuid_from_key", _fbx_uuid_from_key)
-        modify.add_modify(export_fbx_bin, "get_fbx_uuid_from_key", _fbx_uuid_from_key)
+        modify.add_modify(fbx_utils, "get_key_from_fbx_uuid", registry.fbx_key_from_uuid)
+        modify.add_modify(fbx_utils, "get_fbx_uuid_from_key", registry.fbx_uuid_from_key)
+        modify.add_modify(export_fbx_bin, "get_fbx_uuid_from_key", registry.fbx_uuid_from_key)
 
         kwargs_copy = kwargs.copy()
         time = kwargs_copy.get("time")
@@ -82,4 +115,7 @@ def export_fbx(*args, **kwargs):
             modify.add_modify(export_fbx_bin, "datetime", datetime_mod_wrap)
             del kwargs_copy["time"]
 
-        return bpy.ops.export_scene.fbx(*args, **kwargs_copy)
+        try:
+            return bpy.ops.export_scene.fbx(*args, **kwargs_copy)
+        finally:
+            _last_stats = registry.stats
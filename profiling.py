@@ -0,0 +1,211 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# opt-in profiling of public functions of the library.
+# enable() replaces public functions in the package with measuring wrappers and
+# bpy.ops call function with counting one, and disable() restores them,
+# so there is no overhead while profiling is disabled.
+
+import functools
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import bpy
+import bpy.ops
+from bpy.types import Mesh, Object
+
+# public functions of the package to be profiled
+PROFILED_FUNCTIONS = (
+    "mirror_uv",
+    "copy_join",
+    "export_for_unity",
+    "freeze_modifiers",
+    "merge_by_distance",
+    "symmetrize_armature",
+    "apply_transforms",
+    "merge_materials",
+    "merge_materials_with_atlas",
+    "remove_material",
+    "remove_face_of_materials",
+    "simple_merge_materials",
+    "remap_materials",
+    "remove_face_of_group",
+    "select_mirroring",
+)
+
+_MODE_SWITCH_OPERATORS = {"object.mode_set", "object.mode_set_with_submode", "object.editmode_toggle"}
+
+
+class CallRecord:
+    def __init__(self, name: str, start: float):
+        self.name: str = name
+        self.start: float = start
+        self.time: float = 0
+        self.operators: int = 0
+        self.mode_switches: int = 0
+        self.objects_created: int = 0
+        self.objects_deleted: int = 0
+        self.vertices: int = 0
+        self.polygons: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+_enabled = False
+_epoch = 0.0
+_records: List[CallRecord] = []
+_originals: Dict[str, Callable] = {}
+_original_op_call: Optional[Callable] = None
+_operator_count = 0
+_mode_switch_count = 0
+# objects seen at last checkpoint and counts of objects created and deleted between checkpoints
+_seen_objects: Set[int] = set()
+_created_count = 0
+_deleted_count = 0
+
+
+def enable():
+    global _enabled, _epoch, _original_op_call
+    if _enabled:
+        return
+    package = sys.modules[__package__]
+    for name in PROFILED_FUNCTIONS:
+        function = getattr(package, name)
+        _originals[name] = function
+        setattr(package, name, _wrap(name, function))
+    _original_op_call = bpy.ops._op_call
+    bpy.ops._op_call = _counting_op_call
+    _epoch = time.perf_counter()
+    _enabled = True
+
+
+def disable():
+    global _enabled, _original_op_call
+    if not _enabled:
+        return
+    package = sys.modules[__package__]
+    for name, function in _originals.items():
+        setattr(package, name, function)
+    _originals.clear()
+    bpy.ops._op_call = _original_op_call
+    _original_op_call = None
+    _enabled = False
+
+
+def reset():
+    _records.clear()
+
+
+def records() -> List[Dict[str, Any]]:
+    return [record.as_dict() for record in _records]
+
+
+def report() -> Dict[str, Dict[str, Any]]:
+    """totals of records for each function"""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for record in _records:
+        total = totals.setdefault(record.name, dict(
+            calls=0, time=0.0, operators=0, mode_switches=0,
+            objects_created=0, objects_deleted=0, vertices=0, polygons=0))
+        total["calls"] += 1
+        for key in ("time", "operators", "mode_switches", "objects_created", "objects_deleted", "vertices",
+                    "polygons"):
+            total[key] += getattr(record, key)
+    return totals
+
+
+def dump_chrome_trace(path: str):
+    """writes records in chrome trace event format. open with chrome://tracing or perfetto"""
+    events = [{
+        "name": record.name,
+        "ph": "X",
+        "ts": (record.start - _epoch) * 1e6,
+        "dur": record.time * 1e6,
+        "pid": os.getpid(),
+        "tid": 0,
+        "args": {k: v for k, v in record.as_dict().items() if k not in ("name", "start", "time")},
+    } for record in _records]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events}, f)
+
+
+def _counting_op_call(operator, *args, **kwargs):
+    global _operator_count, _mode_switch_count
+    _operator_count += 1
+    if operator in _MODE_SWITCH_OPERATORS:
+        _mode_switch_count += 1
+    _checkpoint_objects()
+    try:
+        return _original_op_call(operator, *args, **kwargs)
+    finally:
+        _checkpoint_objects()
+
+
+def _checkpoint_objects():
+    """
+        count objects created and deleted since last checkpoint.
+        checkpoints are taken around each operator call and profiled function call so temporary objects
+        created by an operator and removed later in the same function are counted.
+    """
+    global _seen_objects, _created_count, _deleted_count
+    objects = _object_pointers()
+    _created_count += len(objects - _seen_objects)
+    _deleted_count += len(_seen_objects - objects)
+    _seen_objects = objects
+
+
+def _wrap(name: str, function: Callable) -> Callable:
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        record = CallRecord(name, time.perf_counter())
+        record.vertices, record.polygons = _count_geometry([*args, *kwargs.values()])
+        _checkpoint_objects()
+        created_before = _created_count
+        deleted_before = _deleted_count
+        operators_before = _operator_count
+        mode_switches_before = _mode_switch_count
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record.time = time.perf_counter() - record.start
+            record.operators = _operator_count - operators_before
+            record.mode_switches = _mode_switch_count - mode_switches_before
+            _checkpoint_objects()
+            record.objects_created = _created_count - created_before
+            record.objects_deleted = _deleted_count - deleted_before
+            _records.append(record)
+    return wrapper
+
+
+def _object_pointers() -> Set[int]:
+    return set(obj.as_pointer() for obj in bpy.data.objects)
+
+
+def _count_geometry(values: Iterable[Any]) -> Tuple[int, int]:
+    vertices = 0
+    polygons = 0
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            v, p = _count_geometry(value)
+            vertices += v
+            polygons += p
+        elif isinstance(value, Object) and isinstance(value.data, Mesh):
+            vertices += len(value.data.vertices)
+            polygons += len(value.data.polygons)
+    return vertices, polygons
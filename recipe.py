@@ -0,0 +1,350 @@
+# anatawa12's blender libraries
+# Copyright (c) 2022 anatawa12
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+
+# declarative build recipes.
+# a recipe is a list of steps, each calls one function of the library with input objects and arguments:
+#
+#   {
+#     "cache_dir": "build_cache",
+#     "steps": [
+#       {"op": "copy_join", "inputs": ["Body", "Cloth"], "args": {"name": "Merged"}},
+#       {"op": "freeze_modifiers", "inputs": ["Merged"], "args": {"modifiers": ["Mirror"]}},
+#       {"op": "merge_by_distance", "inputs": ["Merged"]},
+#       {"op": "export_for_unity", "inputs": ["Merged", "Armature"], "args": {"path": "//avatar.fbx"}}
+#     ]
+#   }
+#
+# outputs of a step are its inputs if not specified, or the joined object for copy_join.
+# key of a step is the hash of its op, args and keys of its inputs, which is fingerprint of the object
+# for objects not produced by former steps. meshes of outputs are saved as array snapshots in cache_dir
+# and if a step with the same key is found, the step is skipped and the snapshot is restored.
+# snapshots are restored just before a step needs to be run, or at the end of the recipe.
+# export steps, steps changing other than meshes of outputs and steps with non-mesh outputs are always run.
+
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union, cast
+
+import bpy
+import numpy as np
+from bpy.types import BlendDataMaterials, Collection, Material, Mesh, Modifier, Object, VertexGroup
+from mathutils import Matrix
+
+from .mesh_arrays import invalidate
+from .mesh_join import MeshParts, assign_object_data, build_mesh, read_mesh_parts
+
+# increase this when the step key or the snapshot format is changed
+_RECIPE_VERSION = 2
+
+
+class Step:
+    def __init__(self, op: str, inputs: List[str], args: Dict[str, Any], outputs: Optional[List[str]] = None,
+                 name: Optional[str] = None):
+        if op not in _OPERATIONS:
+            raise Exception(f"unknown recipe op: {op}")
+        self.op: str = op
+        self.inputs: List[str] = inputs
+        self.args: Dict[str, Any] = args
+        if outputs is None:
+            outputs = _default_outputs(op, inputs, args)
+        self.outputs: List[str] = outputs
+        self.name: str = name if name is not None else op
+
+    @staticmethod
+    def from_dict(value: Dict[str, Any]) -> 'Step':
+        return Step(value["op"], [*value.get("inputs", [])], dict(value.get("args", {})),
+                    [*value["outputs"]] if "outputs" in value else None, value.get("name"))
+
+
+class StepResult:
+    def __init__(self, step: Step, key: str, cached: bool, time: float):
+        self.step: Step = step
+        self.key: str = key
+        self.cached: bool = cached
+        self.time: float = time
+
+
+def load_recipe(path: str) -> Dict[str, Any]:
+    """load recipe from json, or toml if python has tomllib"""
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            raise Exception("TOML recipes need Python 3.11+, use JSON recipe instead")
+        with open(path, "rb") as f:
+            recipe = tomllib.load(f)
+    else:
+        with open(path) as f:
+            recipe = json.load(f)
+    # cache_dir is relative to the recipe file
+    recipe.setdefault("cache_dir", os.path.splitext(os.path.basename(path))[0] + ".cache")
+    recipe["cache_dir"] = os.path.join(os.path.dirname(os.path.abspath(path)), recipe["cache_dir"])
+    return recipe
+
+
+def run_recipe(recipe: Union[str, Dict[str, Any]], use_cache: bool = True, print_table: bool = True) \
+        -> List[StepResult]:
+    """
+        run steps of recipe, a path to recipe file or loaded recipe.
+        if use_cache is False, all steps are run but snapshots are still written.
+        returns the result of each step and prints the timing table if print_table.
+    """
+    if isinstance(recipe, str):
+        recipe = load_recipe(recipe)
+    cache_dir = bpy.path.abspath(recipe.get("cache_dir", "//build_cache"))
+    steps = [Step.from_dict(step) for step in recipe["steps"]]
+
+    from .export_cache import fingerprint_environment
+    environment = fingerprint_environment()
+    # object name to key of the step produced current state of it
+    keys: Dict[str, str] = {}
+    # object name to snapshot not yet restored
+    pending: Dict[str, str] = {}
+    results: List[StepResult] = []
+    for step in steps:
+        start = time.perf_counter()
+        key = _step_key(step, keys, environment)
+        snapshot = os.path.join(cache_dir, key)
+        cacheable = not _OPERATIONS[step.op][1]
+        cached = cacheable and use_cache and os.path.exists(snapshot + ".json")
+        if cached:
+            for name in step.outputs:
+                pending[name] = snapshot
+        else:
+            _restore_pending(pending)
+            _OPERATIONS[step.op][0](_objects(step.inputs), _resolve_args(step.args))
+            if cacheable:
+                outputs = _objects(step.outputs)
+                if all(isinstance(obj.data, Mesh) for obj in outputs):
+                    _write_snapshot(snapshot, outputs, _objects(step.inputs[:1]))
+        for name in step.outputs:
+            keys[name] = key
+        results.append(StepResult(step, key, cached, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    _restore_pending(pending)
+    restore_time = time.perf_counter() - start
+    if print_table:
+        print(format_results(results, restore_time))
+    return results
+
+
+def format_results(results: List[StepResult], restore_time: float = 0.0) -> str:
+    """timing table of steps"""
+    rows = [(str(i), result.step.name, result.step.op, "cached" if result.cached else "ran", f"{result.time:.3f}")
+            for i, result in enumerate(results)]
+    rows.append(("", "(restore)", "", "", f"{restore_time:.3f}"))
+    rows.append(("", "total", "", "", f"{sum(r.time for r in results) + restore_time:.3f}"))
+    header = ("#", "step", "op", "status", "seconds")
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [header, *rows]]
+    return "\n".join(lines)
+
+
+def _each(name: str) -> Callable[[List[Object], Dict[str, Any]], Any]:
+    """operation calling the function for each input object"""
+    return lambda objs, args: [_function(name)(obj, **args) for obj in objs]
+
+
+def _all(name: str) -> Callable[[List[Object], Dict[str, Any]], Any]:
+    """operation calling the function with list of input objects"""
+    return lambda objs, args: _function(name)(objs, **args)
+
+
+def _function(name: str) -> Callable:
+    # through package so profiling wrappers are used if enabled
+    return getattr(sys.modules[__package__], name)
+
+
+# op name to the operation and whether the step must be always run
+_OPERATIONS: Dict[str, Tuple[Callable[[List[Object], Dict[str, Any]], Any], bool]] = {
+    "copy_join": (_all("copy_join"), False),
+    "freeze_modifiers": (_each("freeze_modifiers"), False),
+    "merge_materials": (_each("merge_materials"), False),
+    # the atlas image and material are not in snapshots
+    "merge_materials_with_atlas": (_each("merge_materials_with_atlas"), True),
+    "remap_materials": (_all("remap_materials"), False),
+    "remove_face_of_materials": (_all("remove_face_of_materials"), False),
+    "remove_face_of_group": (_all("remove_face_of_group"), False),
+    "merge_by_distance": (_all("merge_by_distance"), False),
+    "mirror_uv": (_each("mirror_uv"), False),
+    # matrix_parent_inverse of children not in outputs is changed
+    "apply_transforms": (_all("apply_transforms"), True),
+    "symmetrize_armature": (_all("symmetrize_armature"), True),
+    "export_for_unity": (_all("export_for_unity"), True),
+}
+
+
+def _default_outputs(op: str, inputs: List[str], args: Dict[str, Any]) -> List[str]:
+    if op == "copy_join":
+        return [args["name"]]
+    if op == "export_for_unity":
+        return []
+    return [*inputs]
+
+
+def _resolve_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    """convert json values to arguments of the library functions"""
+    from .utils import Axis, UVRegion
+    resolved = dict(args)
+    for name, value in args.items():
+        if name == "path":
+            resolved[name] = bpy.path.abspath(value)
+        elif name == "region_mapping":
+            resolved[name] = {k: UVRegion(*v) for k, v in value.items()}
+        elif name.endswith("axis") and isinstance(value, str):
+            resolved[name] = Axis[value]
+    return resolved
+
+
+def _objects(names: Iterable[str]) -> List[Object]:
+    objs: List[Object] = []
+    for name in names:
+        obj = cast(Dict[str, Object], bpy.data.objects).get(name)
+        if obj is None:
+            raise Exception(f"object named {name} not found")
+        objs.append(obj)
+    return objs
+
+
+def _step_key(step: Step, keys: Dict[str, str], environment: str) -> str:
+    """environment is fingerprint_environment, computed once for a run since steps don't change actions"""
+    from .export_cache import fingerprint_object
+    h = hashlib.sha256()
+    h.update(json.dumps([_RECIPE_VERSION, step.op, step.args, step.outputs], sort_keys=True).encode())
+    for name in step.inputs:
+        key = keys.get(name)
+        if key is None:
+            key = hashlib.sha256((environment + fingerprint_object(_objects([name])[0])).encode()).hexdigest()
+            keys[name] = key
+        h.update(key.encode())
+    return h.hexdigest()
+
+
+def _write_snapshot(path: str, objs: List[Object], template: List[Object]):
+    """write meshes and object state of objs to path.npz and path.json"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays: Dict[str, np.ndarray] = {}
+    infos: List[Dict[str, Any]] = []
+    for i, obj in enumerate(objs):
+        parts = read_mesh_parts(obj)
+        for attr in ("co", "edges", "edge_seams", "edge_sharps", "loop_vertices", "loop_edges", "loop_starts",
+                     "loop_totals", "material_indices", "use_smooth"):
+            arrays[f"{i}/{attr}"] = getattr(parts, attr)
+        if parts.loop_normals is not None:
+            arrays[f"{i}/loop_normals"] = parts.loop_normals
+        for kind, layers in (("uv", parts.uv_layers), ("color", parts.color_layers), ("key", parts.shape_keys)):
+            for j, array in enumerate(layers.values()):
+                arrays[f"{i}/{kind}/{j}"] = array
+        for j, (indices, weights) in enumerate(parts.weights.values()):
+            arrays[f"{i}/group/{j}/indices"] = indices
+            arrays[f"{i}/group/{j}/weights"] = weights
+        infos.append(dict(
+            name=obj.name,
+            template=template[0].name if len(template) != 0 else obj.name,
+            matrix_basis=[[*row] for row in obj.matrix_basis],
+            matrix_parent_inverse=[[*row] for row in obj.matrix_parent_inverse],
+            modifiers=[modifier.name for modifier in cast(List[Modifier], obj.modifiers)],
+            vertex_groups=[group.name for group in cast(List[VertexGroup], obj.vertex_groups)],
+            auto_smooth_angle=parts.auto_smooth_angle,
+            materials=[material.name if material is not None else None for material in parts.materials],
+            uv_layers=[*parts.uv_layers],
+            active_uv_layer=parts.active_uv_layer,
+            color_layers=[*parts.color_layers],
+            shape_keys=[*parts.shape_keys],
+            shape_key_settings=parts.shape_key_settings,
+            groups=[*parts.weights],
+        ))
+    np.savez(path + ".npz", **arrays)
+    # json is written last so half written snapshot is not used
+    with open(path + ".json", "w") as f:
+        json.dump(dict(version=_RECIPE_VERSION, objects=infos), f)
+
+
+def _restore_pending(pending: Dict[str, str]):
+    by_snapshot: Dict[str, List[str]] = {}
+    for name, path in pending.items():
+        by_snapshot.setdefault(path, []).append(name)
+    pending.clear()
+    for path, names in by_snapshot.items():
+        _restore_snapshot(path, names)
+
+
+def _restore_snapshot(path: str, names: List[str]):
+    """
+        restore objects in names from snapshot at path.
+        materials missing in the file are created empty, and modifiers removed by steps are removed,
+        since the snapshot only have names of them.
+    """
+    with open(path + ".json") as f:
+        infos = json.load(f)["objects"]
+    with np.load(path + ".npz") as arrays:
+        for i, info in enumerate(infos):
+            if info["name"] not in names:
+                continue
+            parts = MeshParts()
+            for attr in ("co", "edges", "edge_seams", "edge_sharps", "loop_vertices", "loop_edges", "loop_starts",
+                         "loop_totals", "material_indices", "use_smooth"):
+                setattr(parts, attr, arrays[f"{i}/{attr}"])
+            if f"{i}/loop_normals" in arrays:
+                parts.loop_normals = arrays[f"{i}/loop_normals"]
+            parts.auto_smooth_angle = info["auto_smooth_angle"]
+            parts.materials = [_get_material(name) for name in info["materials"]]
+            parts.uv_layers = {name: arrays[f"{i}/uv/{j}"] for j, name in enumerate(info["uv_layers"])}
+            parts.active_uv_layer = info["active_uv_layer"]
+            parts.color_layers = {name: arrays[f"{i}/color/{j}"] for j, name in enumerate(info["color_layers"])}
+            parts.shape_keys = {name: arrays[f"{i}/key/{j}"] for j, name in enumerate(info["shape_keys"])}
+            parts.shape_key_settings = info["shape_key_settings"]
+            parts.weights = {name: (arrays[f"{i}/group/{j}/indices"], arrays[f"{i}/group/{j}/weights"])
+                             for j, name in enumerate(info["groups"])}
+            _restore_object(info, parts)
+
+
+def _restore_object(info: Dict[str, Any], parts: MeshParts):
+    obj = cast(Dict[str, Object], bpy.data.objects).get(info["name"])
+    if obj is None:
+        template = _objects([info["template"]])[0]
+        obj = cast(Object, template.copy())
+        obj.name = info["name"]
+        cast(List[Collection], template.users_collection)[0].objects.link(obj)
+    old_mesh = cast(Mesh, obj.data)
+    obj.data = build_mesh(info["name"], parts)
+    for slot in obj.material_slots:
+        slot.link = 'DATA'
+    if old_mesh.users == 0:
+        invalidate(old_mesh)
+        bpy.data.meshes.remove(old_mesh)
+
+    obj.vertex_groups.clear()
+    for name in info["vertex_groups"]:
+        obj.vertex_groups.new(name=name)
+    assign_object_data(obj, parts)
+    for modifier in [*cast(List[Modifier], obj.modifiers)]:
+        if modifier.name not in info["modifiers"]:
+            obj.modifiers.remove(modifier)
+    obj.matrix_parent_inverse = Matrix(info["matrix_parent_inverse"])
+    obj.matrix_basis = Matrix(info["matrix_basis"])
+
+
+def _get_material(name: Optional[str]) -> Optional[Material]:
+    if name is None:
+        return None
+    material = cast(Dict[str, Material], bpy.data.materials).get(name)
+    if material is None:
+        material = cast(BlendDataMaterials, bpy.data.materials).new(name)
+    return material
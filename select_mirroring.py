@@ -13,41 +13,66 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
 
-from typing import List, cast
+import itertools
+from typing import Dict, List, Tuple, cast
 
-import bpy
-from bpy.types import Mesh, MeshVertex
-from .utils import Axis
+import numpy as np
+from bpy.types import Mesh, MeshVertex, Object
+from .mesh_arrays import MeshArrays
+from .utils import Axis, vertex_eq
 
+_NEIGHBOR_CELLS = list(itertools.product((-1, 0, 1), repeat=3))
 
-def vertex_eq(v1: List[float], v2: List[float], limit: float = 0.001) -> bool:
-    if len(v1) != len(v2):
-        return False
-    for e1, e2 in zip(v1, v2):
-        if abs(e1 - e2) > limit:
-            return False
-    return True
 
-object = bpy.context.active_object
-if not isinstance(object.data, Mesh):
-    raise Exception("err")
+def select_mirroring(
+        obj: Object,
+        axis: Axis = Axis.X,
+        origin: float = 0,
+        tolerance: float = 0.001,
+        select_both: bool = True,  # if False, only the vertex on the negative side will be selected
+):
+    """
+        select vertices which have mirrored vertex on the mesh.
+        the object must be in object mode.
+    """
+    mesh = obj.data
+    if not isinstance(mesh, Mesh):
+        raise Exception("object is not mesh")
+    if obj.mode == 'EDIT':
+        raise Exception("object is in edit mode")
+    if not tolerance > 0:
+        raise Exception(f"tolerance must be positive: {tolerance}")
 
-mesh: Mesh = object.data
+    vertices = cast(List[MeshVertex], mesh.vertices)
+    co = MeshArrays.of(mesh).co.astype(np.float64)
+    mirrored = co.copy()
+    mirrored[:, axis] = -(co[:, axis] - origin) + origin
 
-axis: Axis = Axis.X
-select_both = True
+    # hashed grid with cell size of tolerance: matching vertex is in the same or neighbor cell
+    grid: Dict[Tuple[int, int, int], List[int]] = {}
+    for index, cell in enumerate(np.floor(co / tolerance).astype(np.int64).tolist()):
+        grid.setdefault(tuple(cell), []).append(index)
 
-bpy.ops.object.mode_set(mode="OBJECT")
+    # v1 is homologous to v2 if v1 is the mirrored position of v2.
+    # this is symmetric so only pairs with v1 <= v2 are collected
+    co_list: List[List[float]] = co.tolist()
+    mirrored_list: List[List[float]] = mirrored.tolist()
+    pairs: List[Tuple[int, int]] = []
+    for v2, (x, y, z) in enumerate(np.floor(mirrored / tolerance).astype(np.int64).tolist()):
+        for dx, dy, dz in _NEIGHBOR_CELLS:
+            for v1 in grid.get((x + dx, y + dy, z + dz), ()):
+                if v1 <= v2 and vertex_eq(co_list[v1], mirrored_list[v2], tolerance):
+                    pairs.append((v1, v2))
 
-for v1 in cast(List[MeshVertex], mesh.vertices):
-    for v2 in cast(List[MeshVertex], mesh.vertices):
-        if vertex_eq(v1.co, axis.invert(v2.co)):
-            if select_both:
-                v1.select = True
-                v2.select = True
-            elif v1.co[axis] < v2.co[axis]:
-                v1.select = True
-            else:
-                v2.select = True
-
-bpy.ops.object.mode_set(mode="EDIT")
+    select = np.zeros(len(vertices), dtype=bool)
+    vertices.foreach_get("select", select)
+    if len(pairs) != 0:
+        v1s, v2s = np.array(pairs, dtype=np.int64).T
+        if select_both:
+            select[v1s] = True
+            select[v2s] = True
+        else:
+            v1_first = co[v1s, axis] < co[v2s, axis]
+            select[v1s[v1_first]] = True
+            select[v2s[~v1_first]] = True
+    vertices.foreach_set("select", select)
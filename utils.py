@@ -14,10 +14,18 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
 
 
+import functools
 from enum import IntEnum
-from typing import List, Tuple, Union, cast
-from bpy.types import Object, Collection, CollectionObjects
+from typing import Dict, Iterable, List, Optional, Tuple, TypeVar, Union, cast
+from bpy.types import Object, Collection, CollectionObjects, Mesh, MeshPolygon, MeshLoop, BlendDataObjects, VertexGroup, \
+    MeshUVLoopLayer
+import bmesh
 import bpy
+import numpy as np
+from .operator_context import OperatorContext
+
+
+E = TypeVar("E")
 
 
 class Axis(IntEnum):
@@ -44,9 +52,24 @@ class UVRegion:
     def fit_to_1x1(self, u: float, v: float) -> Tuple[float, float]:
         return (u - self.u_begin) / self.u_size, (v - self.v_begin) / self.v_size
 
+    def fit_from_1x1_batch(self, uv: np.ndarray) -> np.ndarray:
+        """fit_from_1x1 for (N, 2) array of uv"""
+        return uv * self.size() + self.begin()
+
+    def fit_to_1x1_batch(self, uv: np.ndarray) -> np.ndarray:
+        """fit_to_1x1 for (N, 2) array of uv"""
+        return (uv - self.begin()) / self.size()
+
+    def begin(self) -> np.ndarray:
+        return np.array([self.u_begin, self.v_begin])
+
+    def size(self) -> np.ndarray:
+        return np.array([self.u_size, self.v_size])
+
 
 class ModifyAndRollback:
-    modifications: List[Tuple[object, str, any]] = []
+    def __init__(self):
+        self.modifications: List[Tuple[object, str, any]] = []
 
     def __enter__(self):
         return self
@@ -67,6 +90,121 @@ class ModifyAndRollback:
         self.modifications = []
 
 
+def polygon_loop_indices(loop_starts: np.ndarray, loop_totals: np.ndarray) -> np.ndarray:
+    """
+        flat loop indices of polygons in polygon order.
+        the result is ordered same as np.repeat(polygon_values, loop_totals)
+    """
+    offsets = np.cumsum(loop_totals) - loop_totals
+    return np.arange(int(loop_totals.sum())) + np.repeat(loop_starts - offsets, loop_totals)
+
+
+def read_polygon_loops(mesh: Mesh) -> Tuple[np.ndarray, np.ndarray]:
+    """returns loop_start and loop_total of polygons"""
+    polygons = cast(List[MeshPolygon], mesh.polygons)
+    loop_starts = np.empty(len(polygons), dtype=np.int32)
+    loop_totals = np.empty(len(polygons), dtype=np.int32)
+    polygons.foreach_get("loop_start", loop_starts)
+    polygons.foreach_get("loop_total", loop_totals)
+    return loop_starts, loop_totals
+
+
+def read_material_indices(mesh: Mesh) -> np.ndarray:
+    polygons = cast(List[MeshPolygon], mesh.polygons)
+    material_indices = np.empty(len(polygons), dtype=np.int32)
+    polygons.foreach_get("material_index", material_indices)
+    return material_indices
+
+
+def read_loop_vertices(mesh: Mesh) -> np.ndarray:
+    loops = cast(List[MeshLoop], mesh.loops)
+    loop_vertices = np.empty(len(loops), dtype=np.int32)
+    loops.foreach_get("vertex_index", loop_vertices)
+    return loop_vertices
+
+
+def polygons_all_of(loop_values: np.ndarray, loop_starts: np.ndarray, loop_totals: np.ndarray) -> np.ndarray:
+    """for each polygon, True if loop_values are True for all loops of the polygon"""
+    if len(loop_totals) == 0:
+        return np.zeros(0, dtype=bool)
+    ordered = loop_values[polygon_loop_indices(loop_starts, loop_totals)]
+    return np.logical_and.reduceat(ordered, np.cumsum(loop_totals) - loop_totals)
+
+
+def read_vertex_weights(mesh: Mesh) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """returns mapping from vertex group index to vertex indices and weights of the group"""
+    indices: Dict[int, List[int]] = {}
+    weights: Dict[int, List[float]] = {}
+    bm = bmesh.new()
+    try:
+        bm.from_mesh(mesh)
+        deform = bm.verts.layers.deform.active
+        if deform is not None:
+            for vertex in bm.verts:
+                for group, weight in vertex[deform].items():
+                    if group not in indices:
+                        indices[group] = []
+                        weights[group] = []
+                    indices[group].append(vertex.index)
+                    weights[group].append(weight)
+    finally:
+        bm.free()
+    return {group: (np.array(indices[group], dtype=np.int32), np.array(weights[group], dtype=np.float32))
+            for group in indices}
+
+
+# uv layers parameter: None for the active layer, "all" for all layers, or name(s) of layers
+UVLayers = Union[None, str, Iterable[str]]
+
+
+def uv_layer_names(mesh: Mesh, uv_layers: UVLayers) -> List[Optional[str]]:
+    """names of uv layers selected by uv_layers. None in result means the active layer"""
+    if uv_layers is None:
+        return [None]
+    if uv_layers == "all":
+        return [layer.name for layer in cast(List[MeshUVLoopLayer], mesh.uv_layers)]
+    names: List[Optional[str]] = [*as_list(uv_layers, str)]
+    for name in names:
+        if name not in mesh.uv_layers:
+            raise Exception(f"uv layer {name} not found on {mesh.name}")
+    return names
+
+
+def write_vertex_weights(group: VertexGroup, indices: np.ndarray, weights: np.ndarray):
+    """assign weights to vertices of group with one VertexGroup.add call for each distinct weight"""
+    distinct_weights, inverse, counts = np.unique(weights, return_inverse=True, return_counts=True)
+    indices_by_weight = np.split(indices[np.argsort(inverse, kind='stable')], np.cumsum(counts)[:-1])
+    for weight, weight_indices in zip(cast(List[float], distinct_weights.tolist()), indices_by_weight):
+        group.add(cast(List[int], weight_indices.tolist()), weight, 'REPLACE')
+
+
+def delete_faces(mesh: Mesh, face_mask: np.ndarray) -> int:
+    """
+        delete faces where face_mask is True, and edges and vertices only used by them, like mesh.delete(type='FACE').
+        this works on mesh data so the object must not be in edit mode.
+    """
+    face_indices = np.flatnonzero(face_mask)
+    if len(face_indices) == 0:
+        return 0
+    bm = bmesh.new()
+    try:
+        bm.from_mesh(mesh)
+        bm.faces.ensure_lookup_table()
+        bmesh.ops.delete(bm, geom=[bm.faces[i] for i in face_indices.tolist()], context='FACES')
+        bm.to_mesh(mesh)
+    finally:
+        bm.free()
+    mesh.update()
+    return len(face_indices)
+
+
+def as_list(value: Union[E, Iterable[E]], single: type) -> List[E]:
+    """wraps value with list if value is single element of type single"""
+    if isinstance(value, single):
+        return [value]
+    return [*value]
+
+
 def vertex_eq(v1: List[float], v2: List[float], limit: float = 0.0001) -> bool:
     if len(v1) != len(v2):
         return False
@@ -151,6 +289,10 @@ else:
         return f"{name}{number}"
 
 
+# flip_name is called for every bone and vertex group name again and again
+cached_flip_name = functools.lru_cache(maxsize=None)(flip_name)
+
+
 def find_enable_addon(name):
     from importlib import import_module
     import addon_utils
@@ -172,27 +314,20 @@ def select_objects(objs):
 
 
 def merge_objects(objs):
-    select_objects(objs)
-    bpy.context.view_layer.objects.active = objs[0]
-    bpy.ops.object.join()
+    with OperatorContext(objs) as context:
+        context.mode_set('OBJECT')
+        context.call(bpy.ops.object.join)
 
 
 def delete_objects(objs):
-    select_objects(objs)
-    bpy.ops.object.delete()
-
-
-def copy_join(objs: List[Object], name: str) -> Object:
-    new_objs: List[Object] = cast(List[Object], [obj.copy() for obj in objs])
-    new_objs[0].data = new_objs[0].data.copy()
-    link_to_collection(new_objs, collection=cast(List[Collection], objs[0].users_collection)[0])
-    new_objs[0].name = name
-    merge_objects(new_objs)
-    #new_objs[0].parent = objs[0].parent
-    return new_objs[0]
+    for obj in objs:
+        cast(BlendDataObjects, bpy.data.objects).remove(obj)
 
 
-def link_to_collection(objs, collection: Collection = bpy.context.scene.collection):
+def link_to_collection(objs, collection: Optional[Collection] = None):
+    """link objs to collection, or the collection of the current scene if None"""
+    if collection is None:
+        collection = bpy.context.scene.collection
     for obj in objs:
         cast(CollectionObjects, collection.objects).link(obj)
 
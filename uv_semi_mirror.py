@@ -13,10 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
 
-from typing import Optional, cast, Dict, List, Callable, FrozenSet, Set, Tuple, Iterable, TypeVar, Container, Sequence
+from typing import Optional, cast, Dict, List, Set, Tuple
 
-from bpy.types import Object, Mesh, VertexGroup, MeshVertex, VertexGroupElement, MeshPolygon, UVLoopLayers, MeshUVLoop
-from .utils import Axis, flip_name
+import numpy as np
+from bpy.types import Object, Mesh, VertexGroup
+from mathutils.kdtree import KDTree
+from .mesh_arrays import MeshArrays, invalidate
+from .utils import Axis, UVLayers, flip_name, polygons_all_of, uv_layer_names, write_vertex_weights
 
 
 def mirror_uv(
@@ -30,215 +33,258 @@ def mirror_uv(
         uv_mirror_axis: Optional[Axis] = None,  # None if not mapped
         uv_mirror_origin: float = 0.5,  # mirror origin
         mirror_vertex_group: bool = False,
+        uv_layers: UVLayers = None,  # None for the active layer, "all" or names of layers
 ):
-    dst_obj: Object = dst_obj_in if dst_obj_in is not None else src_obj
+    # arrays of meshes are shared in this call
+    with MeshArrays.sharing():
+        dst_obj: Object = dst_obj_in if dst_obj_in is not None else src_obj
+        src_mesh = cast(Mesh, src_obj.data)
+        dst_mesh = cast(Mesh, dst_obj.data)
+        src_vertex_indices = _get_vertex_indices(src_obj, src_mesh, src_vertex_group)
+        dst_vertex_indices = _get_vertex_indices(dst_obj, dst_mesh, dst_vertex_group)
+        if len(src_vertex_indices) != len(dst_vertex_indices):
+            raise Exception(f"The count of vertex mismatch: src: {len(src_vertex_indices)}, "
+                            f"dst: {len(dst_vertex_indices)}")
+
+        idx_mapping: Dict[int, int] = _make_vertex_mapping(
+            MeshArrays.of(src_mesh).co,
+            MeshArrays.of(dst_mesh).co,
+            src_vertex_indices,
+            dst_vertex_indices,
+            obj_mirror_axis,
+            obj_mirror_origin,
+            obj_ignore_axis,
+        )
+
+        src_polys = _collect_polygons(src_mesh, src_vertex_indices, reverse=True)
+        dst_polys = _collect_polygons(dst_mesh, dst_vertex_indices, keymap=idx_mapping)
+
+        if len(dst_polys) != len(src_polys):
+            raise Exception("polys count mismatch")
+
+        dst_loops, src_loops = _match_loops(dst_polys, src_polys)
+
+        src_arrays = MeshArrays.of(src_mesh)
+        dst_arrays = MeshArrays.of(dst_mesh)
+        uv_mirror_origin = (uv_mirror_origin + 1) / 2
+        # "all" means layers on both meshes. explicit names must be on both meshes
+        src_layer_names = uv_layer_names(src_mesh, uv_layers)
+        for uv_layer in uv_layer_names(dst_mesh, uv_layers):
+            if uv_layer not in src_layer_names:
+                continue
+            uv = src_arrays.uv(uv_layer)[src_loops]
+            if uv_mirror_axis is not None:
+                uv[:, uv_mirror_axis] = 2 * uv_mirror_origin - uv[:, uv_mirror_axis]
+            dst_arrays.uv(uv_layer)[dst_loops] = uv
+            dst_arrays.write_uv(uv_layer)
+
+        if mirror_vertex_group:
+            _mirror_vertex_groups(src_obj, dst_obj, idx_mapping)
+
+
+def _mirror_vertex_groups(src_obj: Object, dst_obj: Object, idx_mapping: Dict[int, int]):
+    """
+        replace weights of mapped dst vertices with weights of src vertices in flipped groups.
+        weights of src are read before modification so this works if src_obj is dst_obj.
+    """
     src_mesh = cast(Mesh, src_obj.data)
     dst_mesh = cast(Mesh, dst_obj.data)
-    src_vertices = [v for v in cast(List['MeshVertex'], src_mesh.vertices)]
-    dst_vertices = [v for v in cast(List['MeshVertex'], dst_mesh.vertices)]
-    src_vertex_indices = _get_vertex_indices(src_obj, src_mesh, src_vertex_group)
-    dst_vertex_indices = _get_vertex_indices(dst_obj, dst_mesh, dst_vertex_group)
-    if len(src_vertex_indices) != len(dst_vertex_indices):
-        raise Exception(f"The count of vertex mismatch: src: {len(src_vertex_indices)}, dst: {len(dst_vertex_indices)}")
-
-    idx_mapping: Dict[int, int] = _make_vertex_mapping(
-        src_vertices,
-        dst_vertices,
-        src_vertex_indices,
-        dst_vertex_indices,
-        _vertex_distance_squared_computer(obj_mirror_axis, obj_mirror_origin, obj_ignore_axis),
-    )
-
-    dst_polys = _collect_polygons(cast(List[MeshPolygon], dst_mesh.polygons), dst_vertex_indices, lambda a: idx_mapping[a])
-    src_polys = _collect_polygons(cast(List[MeshPolygon], src_mesh.polygons), src_vertex_indices)
-
-    src_uv_layer = cast(List[MeshUVLoop],
-                        cast(UVLoopLayers, src_mesh.uv_layers).active.data)  # TODO: selectable by param
-    dst_uv_layer = cast(List[MeshUVLoop],
-                        cast(UVLoopLayers, dst_mesh.uv_layers).active.data)  # TODO: selectable by param
-
-    if len(dst_polys) != len(src_polys):
-        raise Exception("polys count mismatch")
-
-    uv_mirror_origin = (uv_mirror_origin + 1) / 2
-
-    for vertices, dst_polys1 in dst_polys.items():
-        src_polys1 = src_polys[vertices]
-        if src_polys1 is None:
-            raise Exception(f"src_polys1")
-        for (dst_poly, _), (src_poly, _), offset in _all_matched(dst_polys1, src_polys1):
-            for dst_i, src_i in zip(
-                    cast(range, dst_poly.loop_indices),
-                    _offset([i for i in reversed(cast(range, src_poly.loop_indices))], offset)):
-                dst_uv_layer[dst_i].uv = _invert_uv(src_uv_layer[src_i].uv, uv_mirror_axis, uv_mirror_origin)
-    if mirror_vertex_group:
-        for i, dst_vertex in enumerate(dst_vertices):
-            src_vertex_index = idx_mapping.get(i)
-            if src_vertex_index is None:
-                continue
-            src_vertex = src_vertices[idx_mapping[i]]
-            for dst_group in cast(Iterable[VertexGroupElement], dst_vertex.groups):
-                cast(List[VertexGroup], dst_obj.vertex_groups)[dst_group.group].remove([dst_vertex.index])
+    dst_groups = cast(List[VertexGroup], dst_obj.vertex_groups)
+    dst_groups_by_name = cast(Dict[str, VertexGroup], dst_obj.vertex_groups)
+
+    group_mapping: Dict[int, int] = {}
+    for src_group in cast(List[VertexGroup], src_obj.vertex_groups):
+        for dst_group_name_candidate in _flip_name_candidates(src_group.name):
+            dst_group_candidate = dst_groups_by_name.get(dst_group_name_candidate)
+            if dst_group_candidate is not None:
+                group_mapping[src_group.index] = dst_group_candidate.index
+                break
+
+    mapped_dst = np.fromiter(idx_mapping.keys(), dtype=np.int64, count=len(idx_mapping))
+    mapped_src = np.fromiter(idx_mapping.values(), dtype=np.int64, count=len(idx_mapping))
+    is_mapped_dst = np.zeros(len(dst_mesh.vertices), dtype=bool)
+    is_mapped_dst[mapped_dst] = True
+    src_to_dst = np.full(len(src_mesh.vertices), -1, dtype=np.int64)
+    src_to_dst[mapped_src] = mapped_dst
+
+    src_weights = MeshArrays.of(src_mesh).weights
+    dst_weights = MeshArrays.of(dst_mesh).weights
+
+    for group, (indices, _) in dst_weights.items():
+        removing = indices[is_mapped_dst[indices]]
+        if group < len(dst_groups) and len(removing) != 0:
+            dst_groups[group].remove(removing.tolist())
+
+    new_indices: Dict[int, List[np.ndarray]] = {}
+    new_weights: Dict[int, List[np.ndarray]] = {}
+    for src_group, (indices, weights) in src_weights.items():
+        dst_group = group_mapping.get(src_group)
+        if dst_group is None:
+            continue
+        dst_indices = src_to_dst[indices]
+        mapped = dst_indices >= 0
+        new_indices.setdefault(dst_group, []).append(dst_indices[mapped])
+        new_weights.setdefault(dst_group, []).append(weights[mapped])
+
+    for dst_group, index_arrays in new_indices.items():
+        # weights from multiple src groups are added, and clamped like 'ADD' of VertexGroup.add
+        vertices, inverse = np.unique(np.concatenate(index_arrays), return_inverse=True)
+        weights = np.minimum(np.bincount(inverse, np.concatenate(new_weights[dst_group])), 1.0)
+        write_vertex_weights(dst_groups[dst_group], vertices, weights)
+    invalidate(dst_mesh)
 
-            for src_group in cast(Iterable[VertexGroupElement], src_vertex.groups):
-                src_group_name = cast(List[VertexGroup], src_obj.vertex_groups)[src_group.group].name
-                dst_group_name_candidates = _flip_name_candidates(src_group_name)
-                for dst_group_name_candidate in dst_group_name_candidates:
-                    dst_group_candidate = cast(Dict[str, VertexGroup], src_obj.vertex_groups)\
-                        .get(dst_group_name_candidate)
-                    if dst_group_candidate is not None:
-                        dst_group_candidate.add([dst_vertex.index], weight=src_group.weight, type="ADD")
-                        break
+
+# polygon as canonical key, loop start, loop total and rotation the key starts at
+_Polygon = Tuple[Tuple[int, ...], int, int, int]
 
 
 def _collect_polygons(
-        polygons: List[MeshPolygon],
-        vertex_indices: Container[int],
-        keymap: Callable[[int], int] = lambda a: a,
-) -> Dict[FrozenSet[int], Set[Tuple[MeshPolygon, Tuple[int, ...]]]]:
-    mapping: Dict[FrozenSet[int], Set[Tuple[MeshPolygon, Tuple[int, ...]]]] = {}
-    for p in polygons:
-        if not _contains_all(p.vertices, vertex_indices):
+        mesh: Mesh,
+        vertex_indices: np.ndarray,
+        keymap: Optional[Dict[int, int]] = None,
+        reverse: bool = False,
+) -> List[_Polygon]:
+    """
+        collect polygons whose vertices are all in vertex_indices.
+        the key is the vertex indices mapped with keymap, reversed if reverse,
+        and rotated to start at the minimum index so same polygons have same key.
+    """
+    arrays = MeshArrays.of(mesh)
+    loop_starts = arrays.loop_starts
+    loop_totals = arrays.loop_totals
+    loop_vertices = arrays.loop_vertices
+    in_group = np.zeros(len(mesh.vertices), dtype=bool)
+    in_group[vertex_indices] = True
+    selected = np.flatnonzero(polygons_all_of(in_group[loop_vertices], loop_starts, loop_totals))
+    if keymap is not None:
+        lut = np.full(len(mesh.vertices), -1, dtype=np.int64)
+        lut[np.fromiter(keymap.keys(), dtype=np.int64, count=len(keymap))] = \
+            np.fromiter(keymap.values(), dtype=np.int64, count=len(keymap))
+        loop_vertices = lut[loop_vertices]
+
+    vertices = cast(List[int], loop_vertices.tolist())
+    starts = cast(List[int], loop_starts.tolist())
+    totals = cast(List[int], loop_totals.tolist())
+    polygons: List[_Polygon] = []
+    for p in cast(List[int], selected.tolist()):
+        start, total = starts[p], totals[p]
+        poly = vertices[start:start + total]
+        if reverse:
+            poly.reverse()
+        rotation = _canonical_rotation(poly)
+        polygons.append((tuple(poly[rotation:] + poly[:rotation]), start, total, rotation))
+    return polygons
+
+
+def _canonical_rotation(poly: List[int]) -> int:
+    """index of poly the lexicographically minimum rotation starts at"""
+    minimum = min(poly)
+    candidates = [i for i, v in enumerate(poly) if v == minimum]
+    if len(candidates) == 1:
+        return candidates[0]
+    return min(candidates, key=lambda i: poly[i:] + poly[:i])
+
+
+def _match_loops(dst_polys: List[_Polygon], src_polys: List[_Polygon]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+        match polygons with same key and returns loop indices of dst and corresponding loop indices of src.
+        src_polys must be collected with reverse.
+    """
+    src_by_key: Dict[Tuple[int, ...], Tuple[int, int]] = {}
+    duplicated: Set[Tuple[int, ...]] = set()
+    for key, start, _, rotation in src_polys:
+        if key in src_by_key:
+            duplicated.add(key)
+        src_by_key[key] = (start, rotation)
+
+    matched: Set[Tuple[int, ...]] = set()
+    dst_starts: List[int] = []
+    src_starts: List[int] = []
+    totals: List[int] = []
+    shifts: List[int] = []
+    for key, start, total, rotation in dst_polys:
+        src = src_by_key.get(key)
+        if src is None:
             continue
-        vertices = tuple(keymap(k) for k in p.vertices)
-        key = frozenset(vertices)
-        if key not in mapping:
-            mapping[key] = set()
-        mapping[key].add((p, vertices))
-    return mapping
+        if key in duplicated or key in matched:
+            raise Exception("multiple polygon matched")
+        matched.add(key)
+        dst_starts.append(start)
+        src_starts.append(src[0])
+        totals.append(total)
+        shifts.append(src[1] - rotation)
+
+    # k-th loop of dst is ((k + shift) % n)-th loop of reversed src
+    total_array = np.array(totals, dtype=np.int64)
+    k = np.arange(int(total_array.sum())) - np.repeat(np.cumsum(total_array) - total_array, total_array)
+    n = np.repeat(total_array, total_array)
+    dst_loops = np.repeat(np.array(dst_starts, dtype=np.int64), total_array) + k
+    reversed_index = (k + np.repeat(np.array(shifts, dtype=np.int64), total_array)) % n
+    src_loops = np.repeat(np.array(src_starts, dtype=np.int64), total_array) + n - 1 - reversed_index
+    return dst_loops, src_loops
 
 
 def _make_vertex_mapping(
-        src_vertices: List[MeshVertex],
-        dst_vertices: List[MeshVertex],
-        src_vertex_indices: FrozenSet[int],
-        dst_vertex_indices: FrozenSet[int],
-        dist_sq_computer: Callable[[MeshVertex, MeshVertex], float],
+        src_co: np.ndarray,
+        dst_co: np.ndarray,
+        src_vertex_indices: np.ndarray,
+        dst_vertex_indices: np.ndarray,
+        mirror_axis: Axis = Axis.X,
+        mirror_origin: float = 0,  # mirror origin
+        ignore_axis: Optional[Axis] = None,  # if some axis should be ignored on homologous vertex search
 ) -> Dict[int, int]:
     """
         create dst and src index mapping
         this is dst -> src mapping because it should be fast to check if the found dst is already found or not
     """
-    # create dst and src index mapping
-    # this is dst -> src mapping because it should be fast to check if the found dst is already found or not
+    src_key = _mirror_space(src_co, mirror_axis, mirror_origin, ignore_axis, mirror=False)
+    dst_key = _mirror_space(dst_co, mirror_axis, mirror_origin, ignore_axis, mirror=True)
+
+    tree = KDTree(len(dst_vertex_indices))
+    for dst_vertex_idx in cast(List[int], dst_vertex_indices.tolist()):
+        tree.insert(dst_key[dst_vertex_idx], dst_vertex_idx)
+    tree.balance()
+
     idx_mapping: Dict[int, int] = {}
-    for src_vertex_idx in src_vertex_indices:
-        src_vertex = src_vertices[src_vertex_idx]
-        iterator = iter(dst_vertex_indices)
-        best_idx = next(iterator)
-        best_dist_sq = dist_sq_computer(dst_vertices[best_idx], src_vertex)
-        for dst_vertex_idx in iterator:
-            dist_sq = dist_sq_computer(dst_vertices[dst_vertex_idx], src_vertex)
-            if dist_sq < best_dist_sq:
-                best_dist_sq = dist_sq
-                best_idx = dst_vertex_idx
+    for src_vertex_idx in cast(List[int], src_vertex_indices.tolist()):
+        _, best_idx, _ = tree.find(src_key[src_vertex_idx])
 
         if best_idx in idx_mapping:
             raise Exception(
-                f"nearest vertex duplicated: #{best_idx} (#{dst_vertices[best_idx].co}) is for "
-                f"#{src_vertex_idx} (#{src_vertices[src_vertex_idx].co}) and "
-                f"#{idx_mapping[best_idx]} (#{src_vertices[idx_mapping[best_idx]].co})")
+                f"nearest vertex duplicated: #{best_idx} (#{tuple(dst_co[best_idx])}) is for "
+                f"#{src_vertex_idx} (#{tuple(src_co[src_vertex_idx])}) and "
+                f"#{idx_mapping[best_idx]} (#{tuple(src_co[idx_mapping[best_idx]])})")
         idx_mapping[best_idx] = src_vertex_idx
     return idx_mapping
 
 
-def _all_matched(
-        a_iterable: Iterable[Tuple[MeshPolygon, Tuple[int, ...]]],
-        b_iterable: Iterable[Tuple[MeshPolygon, Tuple[int, ...]]],
-) -> Iterable[Tuple[Tuple[MeshPolygon, Tuple[int, ...]], Tuple[MeshPolygon, Tuple[int, ...]], int]]:
-    a_set = set(a_iterable)
-    b_set = set(b_iterable)
-    b_returned = set()
-    for a in a_set:
-        found = False
-        for b in b_set:
-            offset = _match_poly(a[1], b[1])
-            if offset is None:
-                continue
-            if found or (b in b_returned):
-                raise Exception("multiple polygon matched")
-            b_returned.add(b)
-            yield a, b, offset
-            found = True
-
-
-def _match_poly(a: Tuple[int, ...], b: Tuple[int, ...]) -> Optional[int]:
-    if len(a) != len(b):
-        return None
-    al = [*a]
-    bl = [*b]
-
-    bl.reverse()
-
-    for i in range(0, len(al)):
-        if al == bl:
-            return i
-        bl = [*bl[1::], bl[0]]
-
-    return None
-
-
-def _get_vertex_indices(obj: Object, mesh: Mesh, vertex_group: Optional[str]) -> FrozenSet[int]:
-    vertices = cast(List['MeshVertex'], mesh.vertices)
+def _get_vertex_indices(obj: Object, mesh: Mesh, vertex_group: Optional[str]) -> np.ndarray:
     if vertex_group is None:
-        return frozenset([i for i in range(0, len(vertices))])
-    group_index = cast(Dict[str, VertexGroup], obj.vertex_groups)[vertex_group].index
-    if group_index is None:
+        return np.arange(len(mesh.vertices))
+    group = cast(Dict[str, VertexGroup], obj.vertex_groups).get(vertex_group)
+    if group is None:
         raise Exception(f"Vertex group {vertex_group} not found")
-    l: List[int] = []
-    for i, v in enumerate(vertices):
-        for group in cast(List[VertexGroupElement], v.groups):
-            if group.group == group_index:
-                l.append(i)
-    return frozenset(l)
+    return np.flatnonzero(MeshArrays.of(mesh).vertices_in_group(group.index))
 
 
-def _vertex_distance_squared_computer(
-        mirror_axis: Axis = Axis.X,
-        mirror_origin: float = 0,  # mirror origin
-        ignore_axis: Optional[Axis] = None,  # if some axis should be ignored on homologous vertex search
-) -> Callable[[MeshVertex, MeshVertex], float]:
-    scale0: List[int] = [1, 1, 1]
-    scale1: List[int] = [1, 1, 1]
-    origin: List[float] = [0, 0, 0]
-
-    scale1[mirror_axis] = -1
-    origin[mirror_axis] = mirror_origin
-
+def _mirror_space(
+        co: np.ndarray,
+        mirror_axis: Axis,
+        mirror_origin: float,
+        ignore_axis: Optional[Axis],
+        mirror: bool,
+) -> np.ndarray:
+    """
+        move coordinates into the space homologous vertices are searched in:
+        relative to the mirror origin, flipped on the mirror axis if mirror, and zero on the ignored axis
+    """
+    result = co.astype(np.float64)
+    result[:, mirror_axis] -= mirror_origin
+    if mirror:
+        result[:, mirror_axis] *= -1
     if ignore_axis is not None:
-        scale0[ignore_axis] = 0
-        scale1[ignore_axis] = 0
-
-    def get_value(vertex: MeshVertex, axis: Axis, s: List[int]) -> float:
-        return (vertex.co[axis] - origin[axis]) * s[axis]
-
-    def computer(a: MeshVertex, b: MeshVertex) -> float:
-        x = get_value(a, Axis.X, scale1) - get_value(b, Axis.X, scale0)
-        y = get_value(a, Axis.Y, scale1) - get_value(b, Axis.Y, scale0)
-        z = get_value(a, Axis.Z, scale1) - get_value(b, Axis.Z, scale0)
-        return x * x + y * y + z * z
-
-    return computer
-
-
-def _invert_uv(uv: List[float], axis: Optional[Axis], origin: float) -> List[float]:
-    return uv if axis is None else axis.invert(uv, (origin, origin))
-
-
-E = TypeVar("E")
-
-
-def _contains_all(elements: Iterable[E], collection: Container[E]) -> bool:
-    for e in elements:
-        if e not in collection:
-            return False
-    return True
-
-
-def _offset(s: Sequence[E], offset: int) -> List[E]:
-    if offset == 0 and isinstance(s, list):
-        return s
-    return [*s[offset:], *s[0:offset]]
+        result[:, ignore_axis] = 0
+    return result
 
 
 def _flip_name_candidates(name: str) -> List[str]: